@@ -17,8 +17,11 @@
 
 import os
 import re
+import sys
+from operator import itemgetter
 
 from dumbo.util import incrcounter, setstatus, configopts
+from dumbo.profiling import checkprofile
 
 class Params(object):
     """
@@ -88,29 +91,52 @@ class MapRedBase(object):
     status = property(fset=setstatus)
 
 
-class JoinKey(object):
+class JoinKey(tuple):
+    """
+    Key for joins, stored as a (body, flag) tuple with flag 1 for the
+    primary and 2 for the secondary side. Plain tuple comparison thus
+    sorts on the body first and puts primary keys first, and the tuple
+    itself is also the format in which join keys get dumped. Salted keys
+    are (body, salt, flag) tuples, which the partitioner spreads over the
+    reducers since it looks at everything but the flag.
+
+    For joins of more than two tables, the flag is the tag of the table
+    the key comes from instead, and tables get sorted by tag.
+    """
 
-    def __init__(self, body, isprimary=False):
-        self.body = body
-        self.isprimary = isprimary
-  
-    def __cmp__(self, other):
-        if isinstance(other, JoinKey):
-            # For isprimary, order is switched because we want True to sort before False
-            return cmp(self.body, other.body) or cmp(other.isprimary, self.isprimary)
-        else:
-            return -1     # JoinKeys arbitrarily come before everything else
+    __slots__ = ()
+
+    def __new__(cls, body, isprimary=False, salt=None, tag=None):
+        if tag is None:
+            tag = 2 - int(isprimary)
+        if salt is None:
+            return tuple.__new__(cls, (body, tag))
+        return tuple.__new__(cls, (body, salt, tag))
+
+    def __getnewargs__(self):
+        return (self[0], self[-1] == 1, self.salt, self[-1])
+
+    body = property(itemgetter(0))
+    tag = property(itemgetter(-1))
+    isprimary = property(lambda self: self[-1] == 1)
+    salt = property(lambda self: self[1] if len(self) == 3 else None)
+
+    def withbody(self, body):
+        """Returns a join key for the same side with a different body"""
+        if len(self) == 2:
+            return tuple.__new__(type(self), (body, self[1]))
+        return tuple.__new__(type(self), (body, self[1], self[2]))
 
     @classmethod
     def fromjoinkey(cls, jk):
-        return cls(jk.body, jk.isprimary)
+        return tuple.__new__(cls, tuple(jk))
 
     @classmethod
     def fromdump(cls, dump):
-        return cls(dump[0], dump[1] == 1)
+        return tuple.__new__(cls, tuple(dump))
 
     def dump(self):
-        return (self.body, 2 - int(self.isprimary))
+        return tuple(self)
 
     def __repr__(self):
         return repr(self.dump())
@@ -131,7 +157,10 @@ class Iteration(object):
         opts = self.opts
         attrs = ['fake', 'debug', 'python', 'iteration', 'itercount', 'hadoop', 
             'starter', 'name', 'memlimit', 'param', 'parser', 'record', 
-            'joinkeys', 'hadoopconf', 'mapper', 'reducer']
+            'joinkeys', 'hadoopconf', 'mapper', 'reducer', 'codec',
+            'combining', 'combinerentries', 'combinerbytes', 'combinerevict',
+            'blocksize', 'mapprocs', 'profile', 'profiledir', 'timing',
+            'memsoftlimit', 'spillbytes', 'secondarysort']
         addedopts = opts.filter(attrs)
         opts.remove(*attrs)
 
@@ -212,6 +241,26 @@ class Iteration(object):
             opts.add('cmdenv', 'dumbo_joinkeys=yes')
             opts.add('partitioner', 'org.apache.hadoop.mapred.lib.BinaryPartitioner')
             opts.add('jobconf', 'mapred.binary.partitioner.right.offset=-6')
+        if 'yes' in addedopts['secondarysort']:
+            # partition on the group hash, i.e. the first vector element
+            opts.add('cmdenv', 'dumbo_secondarysort=yes')
+            opts.add('partitioner', 'org.apache.hadoop.mapred.lib.BinaryPartitioner')
+            opts.add('jobconf', 'mapred.binary.partitioner.left.offset=6')
+            opts.add('jobconf', 'mapred.binary.partitioner.right.offset=9')
+        if addedopts['profile']:
+            error = checkprofile(addedopts['profile'][0])
+            if error:
+                print >> sys.stderr, 'ERROR:', error
+                return 1
+        if addedopts['codec']:
+            codec = addedopts['codec'][0]
+            opts.add('cmdenv', 'dumbo_codec=' + codec)
+            opts.add('codec', codec)
+        for key in ('combining', 'combinerentries', 'combinerbytes',
+                    'combinerevict', 'blocksize', 'mapprocs', 'profile',
+                    'profiledir', 'timing', 'memsoftlimit', 'spillbytes'):
+            if addedopts[key]:
+                opts.add('cmdenv', 'dumbo_%s=%s' % (key, addedopts[key][0]))
         for hadoopconf in addedopts['hadoopconf']:
             opts.add('jobconf', hadoopconf)
         opts.add('libegg', re.sub('\.egg.*$', '.egg', __file__))
@@ -238,6 +287,9 @@ class FileSystem(object):
     def get(self, path1, path2, opts):
         return 1  # fail by default
 
+    def size(self, path, opts):
+        return None  # unknown by default
+
 
 class Backend(object):
     
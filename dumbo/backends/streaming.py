@@ -17,10 +17,12 @@
 import os
 import sys
 import re
+import struct
+import tempfile
 
 from dumbo.backends.common import Backend, Iteration, FileSystem, RunInfo
 from dumbo.util import (configopts, envdef, execute, findhadoop, findjar,
-        dumpcode, dumptext, Options)
+        dumpcode, dumptext, writesequencefile, Options)
 
 
 class StreamingBackend(Backend):
@@ -58,7 +60,7 @@ class StreamingIteration(Iteration):
             'inputformat', 'outputformat', 'nummaptasks', 'numreducetasks',
             'priority', 'queue', 'cachefile', 'cachearchive', 'file',
             'codewritable', 'addpath', 'getpath', 'python', 'streamoutput',
-            'pypath', 'hadooplib']
+            'pypath', 'hadooplib', 'codec', 'totalorder']
         addedopts = opts.filter(keys)
         opts.remove(*keys)
 
@@ -176,6 +178,17 @@ class StreamingIteration(Iteration):
         hadenv = envdef('HADOOP_CLASSPATH', addedopts['libjar'], 'libjar',
             self.opts, shortcuts=dict(configopts('jars', self.prog)))
 
+        if addedopts['totalorder']:
+            partitions = int(numreducetasks[0]) if numreducetasks else 1
+            path = writepartitionfile(hadoop, streamingjar, hadenv,
+                                      addedopts['totalorder'][0], partitions)
+            if not path:
+                return 1
+            opts.add('partitioner',
+                     'org.apache.hadoop.mapred.lib.TotalOrderPartitioner')
+            opts.add('jobconf', 'total.order.partitioner.path=%s' % path)
+            opts.add('cmdenv', 'dumbo_manifest=yes')
+
         tmpfiles = []
         for _file in opts.pop('file'):
             if _file.startswith('file://'):
@@ -203,6 +216,51 @@ class StreamingIteration(Iteration):
                 execute("%s/bin/hadoop fs -rmr '%s'" % (hadoop, path))
         return retval
 
+
+def writepartitionfile(hadoop, streamingjar, hadenv, splitspath, partitions):
+    """
+    Turns the split keys output by the -totalorder sampling job into the
+    sequence file of TypedBytesWritable keys and NullWritable values that
+    TotalOrderPartitioner reads, and returns its path
+    """
+    import typedbytes
+    from cStringIO import StringIO
+    dumptb = os.popen("%s %s/bin/hadoop jar %s dumptb '%s/part-00000' "
+                      "2> /dev/null" % (hadenv, hadoop, streamingjar, splitspath))
+    try:
+        keys = []
+        for (key, _) in typedbytes.PairedInput(dumptb).reads():
+            buf = StringIO()
+            typedbytes.Output(buf).write(key)
+            keys.append(buf.getvalue())
+    finally:
+        dumptb.close()
+    if len(keys) != partitions - 1:
+        # the partitioner needs exactly this many strictly increasing keys
+        print >> sys.stderr, 'ERROR: -totalorder needs %i distinct split ' \
+                             'keys for %i reducers but only sampled %i, try ' \
+                             'a higher sample rate or fewer reducers' % \
+                             (partitions - 1, partitions, len(keys))
+        return None
+    (fd, localpath) = tempfile.mkstemp(prefix='dumbo-partitions-')
+    try:
+        localfile = os.fdopen(fd, 'wb')
+        records = ((struct.pack('>i', len(key)) + key, '') for key in keys)
+        writesequencefile(localfile,
+                          'org.apache.hadoop.typedbytes.TypedBytesWritable',
+                          'org.apache.hadoop.io.NullWritable', records)
+        localfile.close()
+        path = splitspath + '/_partitions'
+        retval = execute("%s/bin/hadoop fs -put '%s' '%s'"
+                         % (hadoop, localpath, path), printcmd=False)
+    finally:
+        os.remove(localpath)
+    if retval != 0:
+        print >> sys.stderr, 'ERROR: Could not store the -totalorder partitions'
+        return None
+    return path
+
+
 class StreamingFileSystem(FileSystem):
     
     def __init__(self, hadoop):
@@ -233,8 +291,11 @@ class StreamingFileSystem(FileSystem):
                 dumptb = os.popen('%s %s/bin/hadoop jar %s dumptb %s 2> /dev/null'
                                   % (hadenv, self.hadoop, streamingjar, subpath))
 
-                dump = dumpcode if 'yes' in opts['ascode'] else dumptext
-                outputs = dump(typedbytes.PairedInput(dumptb))
+                if 'yes' in opts['ascode']:
+                    codec = opts['codec'][0] if opts['codec'] else None
+                    outputs = dumpcode(typedbytes.PairedInput(dumptb), codec)
+                else:
+                    outputs = dumptext(typedbytes.PairedInput(dumptb))
 
                 for output in outputs:
                     print '\t'.join(output)
@@ -263,6 +324,16 @@ class StreamingFileSystem(FileSystem):
         return execute("%s -get '%s' '%s'" % (self.hdfs, path1,
                        path2), printcmd=False)
 
+    def size(self, path, opts):
+        dus = os.popen("%s -dus '%s' 2> /dev/null" % (self.hdfs, path))
+        try:
+            for token in dus.read().split():
+                if token.isdigit():
+                    return int(token)
+        finally:
+            dus.close()
+        return None
+
 
 class StreamingRunInfo(RunInfo):
 
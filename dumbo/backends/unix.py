@@ -5,10 +5,20 @@ Created on 26 Jul 2010
 '''
 
 import sys
+import os
+import glob
+import shutil
+import tempfile
 import operator
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from dumbo.backends.common import Backend, Iteration, FileSystem
-from dumbo.util import configopts, envdef, execute, Options
+from dumbo.util import (configopts, envdef, execute, executeall, Options,
+    expandpaths)
 from dumbo.cmd import decodepipe
 
 
@@ -31,6 +41,10 @@ class UnixIteration(Iteration):
         self.opts += Options(configopts('unix', prog, self.opts))
 
     def run(self):
+        if self.opts['profile'] and not self.opts['profiledir'] and \
+        self.opts['output']:
+            profiledir = os.path.abspath(self.opts['output'][0]) + '_profile'
+            self.opts.add('profiledir', profiledir)
         retval = Iteration.run(self)
         if retval != 0:
             return retval
@@ -38,7 +52,8 @@ class UnixIteration(Iteration):
         opts = self.opts
         keys = ['input', 'output', 'mapper', 'reducer', 'libegg', 'delinputs',
             'cmdenv', 'pv', 'addpath', 'inputformat', 'outputformat',
-            'numreducetasks', 'python', 'pypath', 'sorttmpdir', 'sortbufsize']
+            'numreducetasks', 'python', 'pypath', 'sorttmpdir', 'sortbufsize',
+            'codec', 'localprocs', 'directinput', 'totalorder', 'reducegrouping']
         addedopts = opts.filter(keys)
         opts.remove(*keys)
 
@@ -56,7 +71,7 @@ class UnixIteration(Iteration):
         pyenv = envdef('PYTHONPATH', addedopts['libegg'],
             shortcuts=dict(configopts('eggs', self.prog)), 
             extrapaths=addedopts['pypath'])
-        cmdenv = ' '.join("%s='%s'" % tuple(arg.split('=')) for arg in
+        cmdenv = ' '.join("%s='%s'" % tuple(arg.split('=', 1)) for arg in
                           addedopts['cmdenv'])
 
         if 'yes' in addedopts['pv']:
@@ -71,43 +86,163 @@ class UnixIteration(Iteration):
         if addedopts['sortbufsize']:
             sortbufsize = "-S %s" % addedopts['sortbufsize'][0]
 
+        # let the reducers group by hashing instead of sorting the map output
+        hashgrouping = 'hash' in addedopts['reducegrouping']
+        if hashgrouping and ('dumbo_joinkeys=yes' in addedopts['cmdenv'] or
+                             'dumbo_secondarysort=yes' in addedopts['cmdenv'] or
+                             addedopts['totalorder']):
+            print >> sys.stderr, 'WARNING: sorting since the keys need to be ordered'
+            hashgrouping = False
+        redcmdenv = cmdenv
+        if hashgrouping:
+            redcmdenv += ' dumbo_reducegrouping=hash'
+
         python = addedopts['python'][0]
-        encodepipe = pyenv + ' ' + python + \
-                     ' -m dumbo.cmd encodepipe -file ' + ' -file '.join(inputs)
+        encodepipe = pyenv + ' ' + python + ' -m dumbo.cmd encodepipe'
 
         if 'code' in addedopts['inputformat']:
             encodepipe += ' -alreadycoded yes'
-        if addedopts['addpath'] and 'no' not in addedopts['addpath']:
+        if addedopts['codec']:
+            encodepipe += " -codec '%s'" % addedopts['codec'][0]
+        addpath = bool(addedopts['addpath']) and \
+                  'no' not in addedopts['addpath']
+        if addpath:
             encodepipe += ' -addpath yes'
-        if addedopts['numreducetasks'] and addedopts['numreducetasks'][0] == '0':
-            retval = execute("%s | %s %s %s %s > '%s'" % (encodepipe,
-                                                          pyenv,
-                                                          cmdenv,
-                                                          mapper,
-                                                          mpv,
-                                                          output))
+
+        # let the mapper read text input itself instead of via encodepipe
+        directinput = 'code' not in addedopts['inputformat'] and \
+                      'no' not in addedopts['directinput']
+
+        textinputs = []  # files that list the splits for direct input
+
+        def mapcmd(splits):
+            if directinput:
+                # in a file since arguments cannot be longer than 128KB
+                (fd, path) = tempfile.mkstemp(prefix='dumbo-splits-',
+                                              suffix='.json')
+                textinputs.append(path)
+                textinput = os.fdopen(fd, 'w')
+                json.dump({'splits': splits, 'addpath': addpath}, textinput)
+                textinput.close()
+                return "%s %s dumbo_textinput=%s %s < /dev/null" % \
+                       (pyenv, cmdenv, shellquote(path), mapper)
+            if len(splits) == 1 and splits[0][2] is not None:
+                source = "%s -file '%s' -offset %i -length %i" % \
+                         ((encodepipe, ) + tuple(splits[0]))
+            else:  # unquoted to let the shell expand patterns
+                source = encodepipe + ' -file ' + \
+                         ' -file '.join(path for (path, _, _) in splits)
+            return '%s | %s %s %s' % (source, pyenv, cmdenv, mapper)
+
+        if addedopts['localprocs'] and int(addedopts['localprocs'][0]) > 1:
+            procs = int(addedopts['localprocs'][0])
+            if addedopts['numreducetasks']:
+                numreducers = int(addedopts['numreducetasks'][0])
+            else:
+                numreducers = procs
+            if not os.path.exists(output):
+                os.makedirs(output)
+            tmpdir = tempfile.mkdtemp(prefix='dumbo-',
+                dir=addedopts['sorttmpdir'][0] if addedopts['sorttmpdir'] else None)
+            partitionpipe = '%s %s -m dumbo.cmd partitionpipe -partitions %i' \
+                            % (pyenv, python, numreducers)
+            if addedopts['codec']:
+                partitionpipe += " -codec '%s'" % addedopts['codec'][0]
+            if 'dumbo_joinkeys=yes' in addedopts['cmdenv']:
+                partitionpipe += ' -joinkeys yes'
+            if 'dumbo_secondarysort=yes' in addedopts['cmdenv']:
+                partitionpipe += ' -secondarysort yes'
+            redenv = redcmdenv
+            if addedopts['totalorder']:
+                splits = addedopts['totalorder'][0]
+                if os.path.isdir(splits):
+                    splits = os.path.join(splits, 'part-00000')
+                partitionpipe += " -splits '%s'" % splits
+                redenv += " dumbo_manifest=yes dumbo_manifestdir='%s'" % output
+
+            mapcmds = []
+            splits = getsplits(expandpaths(inputs), procs)
+            for (i, split) in enumerate(splits):
+                if numreducers == 0:
+                    dest = "> '%s/part-%05i'" % (output, i)
+                else:
+                    dest = "| %s -prefix '%s/map-%05i'" % \
+                           (partitionpipe, tmpdir, i)
+                mapcmds.append('%s %s' % (mapcmd([split]), dest))
+            try:
+                retval = executeall(mapcmds, procs)
+                if retval == 0 and numreducers > 0:
+                    redcmds = []
+                    if hashgrouping:
+                        source = 'cat'
+                    else:
+                        source = 'LC_ALL=C sort %s %s' % (sorttmpdir, sortbufsize)
+                    for i in xrange(numreducers):
+                        redcmds.append("%s '%s'/map-*-%05i | "
+                                       "%s %s dumbo_part=part-%05i %s > "
+                                       "'%s/part-%05i'"
+                                       % (source, tmpdir, i, pyenv, redenv, i,
+                                          reducer, output, i))
+                    retval = executeall(redcmds, procs)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
         else:
-            retval = execute("%s | %s %s %s %s| LC_ALL=C sort %s %s %s| %s %s %s %s> '%s'"
-                             % (encodepipe,
-                                pyenv,
-                                cmdenv,
-                                mapper,
-                                mpv,
-                                sorttmpdir,
-                                sortbufsize,
-                                spv,
-                                pyenv,
-                                cmdenv,
-                                reducer,
-                                rpv,
-                                output))
+            if directinput:
+                splits = [(path, 0, None) for path in expandpaths(inputs)]
+            else:
+                splits = [(path, 0, None) for path in inputs]
+            if addedopts['numreducetasks'] and \
+            addedopts['numreducetasks'][0] == '0':
+                retval = execute("%s %s > '%s'" % (mapcmd(splits), mpv, output))
+            elif hashgrouping:
+                retval = execute("%s %s| %s %s %s %s> '%s'"
+                                 % (mapcmd(splits),
+                                    mpv,
+                                    pyenv,
+                                    redcmdenv,
+                                    reducer,
+                                    rpv,
+                                    output))
+            else:
+                retval = execute("%s %s| LC_ALL=C sort %s %s %s| %s %s %s %s> '%s'"
+                                 % (mapcmd(splits),
+                                    mpv,
+                                    sorttmpdir,
+                                    sortbufsize,
+                                    spv,
+                                    pyenv,
+                                    cmdenv,
+                                    reducer,
+                                    rpv,
+                                    output))
+        for path in textinputs:
+            os.remove(path)
 
         if 'yes' in addedopts['delinputs']:
-            for _file in addedopts['input']:
-                execute('rm ' + _file)
+            for pattern in addedopts['input']:
+                for _file in glob.glob(pattern) or [pattern]:
+                    execute('rm -rf %s' % shellquote(_file))
         return retval
 
 
+def shellquote(value):
+    return "'%s'" % value.replace("'", "'\\''")
+
+
+def getsplits(paths, count):
+    """Divides the given files in about count byte ranges"""
+    sizes = [(path, os.path.getsize(path)) for path in paths]
+    splitsize = max(sum(size for (_, size) in sizes) / count, 1)
+    splits = []
+    for (path, size) in sizes:
+        offset = 0
+        while size - offset > splitsize * 1.1:  # avoid tiny last splits
+            splits.append((path, offset, splitsize))
+            offset += splitsize
+        splits.append((path, offset, size - offset))
+    return splits
+
+
 class UnixFileSystem(FileSystem):
 
     def cat(self, path, opts):
@@ -129,3 +264,9 @@ class UnixFileSystem(FileSystem):
 
     def get(self, path1, path2, opts):
         return execute("cp '%s' '%s'" % (path1, path2), printcmd=False)
+
+    def size(self, path, opts):
+        paths = expandpaths([path])
+        if not all(os.path.isfile(p) for p in paths):
+            return None
+        return sum(os.path.getsize(p) for p in paths)
@@ -16,10 +16,15 @@
 
 import sys
 import os
+import shutil
+import tempfile
+from zlib import crc32
+from bisect import bisect_right
 
 from dumbo.util import (dumpcode, Options, loadcode, dumptext, loadtext,
-    configopts, parseargs, execute, envdef)
+    configopts, parseargs, execute, envdef, getcodec, expandpaths, readsplit)
 from dumbo.backends import create_filesystem
+from dumbo.profiling import report
 
 
 def dumbo():
@@ -34,7 +39,9 @@ def dumbo():
         print '  dumbo get <path1> <path2> [<options>]'
         print '  dumbo encodepipe [<options>]'
         print '  dumbo decodepipe [<options>]'
+        print '  dumbo partitionpipe [<options>]'
         print '  dumbo doctest <python program>'
+        print '  dumbo profile <directory> [<options>]'
         return 1
     if sys.argv[1] == 'start':
         retval = start(sys.argv[2], parseargs(sys.argv[2:]))
@@ -54,8 +61,12 @@ def dumbo():
         retval = encodepipe(parseargs(sys.argv[2:]))
     elif sys.argv[1] == 'decodepipe':
         retval = decodepipe(parseargs(sys.argv[2:]))
+    elif sys.argv[1] == 'partitionpipe':
+        retval = partitionpipe(parseargs(sys.argv[2:]))
     elif sys.argv[1] == 'doctest':
         retval = doctest(sys.argv[2])
+    elif sys.argv[1] == 'profile':
+        retval = profile(sys.argv[2], parseargs(sys.argv[2:]))
     elif sys.argv[1].endswith('.py'):
         retval = start(sys.argv[1], parseargs(sys.argv[1:]))
     else:
@@ -138,21 +149,31 @@ def get(path1, path2, opts):
 
 def encodepipe(opts=None):
     opts = opts or Options()
-    keys = ['addpath', 'file', 'alreadycoded']
+    keys = ['addpath', 'file', 'alreadycoded', 'codec', 'offset', 'length']
     addedopts = opts.filter(keys)
     opts.remove(*keys)
 
-    ofiles = addedopts['file']
+    ofiles = expandpaths(addedopts['file'])
     files = map(open, ofiles) if ofiles else [sys.stdin]
 
-    loadfun = loadcode if addedopts['alreadycoded'] else loadtext
+    codec = getcodec(addedopts['codec'][0] if addedopts['codec'] else None)
     addpath = addedopts['addpath']
 
     for _file in files:
-        outputs = loadfun(line[:-1] for line in _file)
+        if addedopts['offset'] or addedopts['length']:
+            offset = int(addedopts['offset'][0]) if addedopts['offset'] else 0
+            length = int(addedopts['length'][0]) if addedopts['length'] \
+                     else os.fstat(_file.fileno()).st_size - offset
+            (offset, lines) = readsplit(_file, offset, length)
+        else:
+            (offset, lines) = (0, _file)
+        if addedopts['alreadycoded']:
+            outputs = loadcode((line[:-1] for line in lines), codec)
+        else:
+            outputs = loadtext((line[:-1] for line in lines), offset)
         if addpath:
             outputs = (((_file.name, key), value) for (key, value) in outputs)
-        for output in dumpcode(outputs):
+        for output in dumpcode(outputs, codec):
             print '\t'.join(output)
         _file.close()
     return 0
@@ -160,16 +181,80 @@ def encodepipe(opts=None):
 
 def decodepipe(opts=None):
     opts = opts or Options()
-    ofiles = opts.pop('file')
+    ofiles = expandpaths(opts.pop('file'))
     files = map(open, ofiles) if ofiles else [sys.stdin]
 
+    codecopt = opts.pop('codec')
+    codec = getcodec(codecopt[0] if codecopt else None)
+
     for _file in files:
-        outputs = loadcode(line[:-1] for line in _file)
+        outputs = loadcode((line[:-1] for line in _file), codec)
         for output in dumptext(outputs):
             print '\t'.join(output)
         _file.close()
+    return 0
+
+
+def partitionpipe(opts=None):
+    opts = opts or Options()
+    keys = ['partitions', 'prefix', 'joinkeys', 'codec', 'splits',
+            'secondarysort']
+    addedopts = opts.filter(keys)
+    opts.remove(*keys)
+
+    count = int(addedopts['partitions'][0])
+    prefix = addedopts['prefix'][0]
+    outfiles = [open('%s-%05d' % (prefix, i), 'w') for i in xrange(count)]
+
+    codec = getcodec(addedopts['codec'][0] if addedopts['codec'] else None)
+    joinkeys = 'yes' in addedopts['joinkeys']
+    secondarysort = 'yes' in addedopts['secondarysort']
+
+    if addedopts['splits']:
+        # range partitioning on the key text, which is how the keys get sorted
+        splits = [line.split('\t', 1)[0] for line in open(addedopts['splits'][0])]
+        for line in sys.stdin:
+            keytext = line.split('\t', 1)[0]
+            outfiles[bisect_right(splits, keytext)].write(line)
+        for outfile in outfiles:
+            outfile.close()
         return 0
 
+    for line in sys.stdin:
+        keytext = line.split('\t', 1)[0]
+        if joinkeys:
+            # all join keys with the same body go to the same partition
+            keytext = codec.dumps(codec.loads(keytext)[:-1])
+        elif secondarysort:
+            # the keys start with the hash of the group they belong to
+            outfiles[codec.loads(keytext)[0] % count].write(line)
+            continue
+        outfiles[(crc32(keytext) & 0x7fffffff) % count].write(line)
+    for outfile in outfiles:
+        outfile.close()
+    return 0
+
+
+def profile(path, opts):
+    opts = Options(opts)
+    opts += Options(configopts('common'))
+    opts += Options(configopts('profile'))
+    sort = opts.pop('sort')
+    limit = opts.pop('limit')
+    sort = sort[0] if sort else 'cumulative'
+    limit = int(limit[0]) if limit else 40
+    if os.path.isdir(path):
+        return report(path, sort, limit)
+    tmpdir = tempfile.mkdtemp(prefix='dumbo-profile-')
+    try:  # not a local directory, so try to get it from the filesystem
+        localpath = os.path.join(tmpdir, 'profiles')
+        retval = create_filesystem(opts).get(path, localpath, opts)
+        if retval != 0:
+            return retval
+        return report(localpath, sort, limit)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
 
 def doctest(prog):
     import doctest
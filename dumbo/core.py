@@ -19,9 +19,26 @@ import os
 import types
 import resource
 import copy
-from itertools import groupby, chain
+import errno
+import heapq
+import select
+import tempfile
+import traceback
+import cPickle
+import random
+import struct
+from bisect import bisect_left
+from zlib import crc32
+from itertools import groupby, chain, islice
 from operator import itemgetter
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from dumbo import profiling
+from dumbo.memory import getmanager
 from dumbo.backends import get_backend
 from dumbo.util import *
 from dumbo.cmd import *
@@ -250,16 +267,31 @@ def run(mapper,
         iterarg = 0  # default value
         if len(sys.argv) > 2:
             iterarg = int(sys.argv[2])
-        memlim = None  # memory limit
+        (memlim, memory) = (None, None)  # memory limit and manager
         if len(sys.argv) > 3:
             memlim = int(sys.argv[3])
-            resource.setrlimit(resource.RLIMIT_AS, (memlim, memlim))
+            softlim = os.environ.get('dumbo_memsoftlimit')
+            memory = getmanager(memlim, softlim and parsebytes(softlim))
+            if not memory:  # cannot measure, so cap the address space
+                resource.setrlimit(resource.RLIMIT_AS, (memlim, memlim))
 
         mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
         jk_class = loadclassname(os.environ['dumbo_jk_class'])
         runinfo = loadclassname(os.environ['dumbo_runinfo_class'])()
+        codec = getcodec(os.environ.get('dumbo_codec'))
 
         if iterarg == iter:
+            if os.environ.has_key('dumbo_profile'):
+                profiledir = os.environ.get('dumbo_profiledir') or \
+                             os.environ.get('mapred_work_output_dir', '.')
+                taskname = os.environ.get('mapred_task_id') or \
+                           os.environ.get('mapreduce_task_attempt_id') or \
+                           '%s-%i' % (sys.argv[1], os.getpid())
+                profiling.starttask(os.environ['dumbo_profile'], profiledir,
+                                    taskname)
+            timer = None
+            if os.environ.get('dumbo_timing', 'no') != 'no':
+                timer = profiling.PhaseTimer()
             if sys.argv[1].startswith('map'):
                 if type(mapper) in (types.ClassType, type):
                     mappercls = type('DumboMapper', (mapper, mrbase_class), {})
@@ -272,6 +304,10 @@ def run(mapper,
                     mapper = mapper.map
                 if hasattr(mapper, 'cleanup'):
                     mapcleanup = mapper.cleanup
+                samplerate = os.environ.get('dumbo_samplerate')
+                if samplerate:  # sampling keys for -totalorder
+                    combiner = None
+                associative = getattr(combiner, 'associative', False)
                 if type(combiner) in (types.ClassType, type):
                     combinercls = type('DumboCombiner', (combiner, mrbase_class), {})
                     combiner = combinercls()
@@ -288,18 +324,41 @@ def run(mapper,
                                          os.environ['map_input_file']
                 except KeyError:
                     pass
-                if os.environ.has_key('stream_map_input') and \
+                if os.environ.has_key('dumbo_textinput'):
+                    print >> sys.stderr, "INFO: reading text input directly"
+                    splitsfile = open(os.environ['dumbo_textinput'])
+                    try:
+                        textinput = json.load(splitsfile)
+                    finally:
+                        splitsfile.close()
+                    inputs = loadtextfiles(textinput['splits'],
+                                           textinput.get('addpath'))
+                elif os.environ.has_key('stream_map_input') and \
                 os.environ['stream_map_input'].lower() == 'typedbytes':
                     print >> sys.stderr, "INFO: inputting typed bytes"
                     try: import ctypedbytes as typedbytes
                     except ImportError: import typedbytes
                     inputs = typedbytes.PairedInput(sys.stdin).reads()
+                elif timer:
+                    inputs = loadcode(timer.readlines(sys.stdin), codec)
                 else:
-                    inputs = loadcode(line[:-1] for line in sys.stdin)
+                    inputs = loadcode((line[:-1] for line in sys.stdin), codec)
+                if samplerate:
+                    inputs = itersample(inputs, float(samplerate))
                 if mapconf:
                     mapconf()
                 if combconf:
                     combconf()
+                if timer:
+                    timer.add('Reading input', loadtextfiles, readsplit)
+                    timer.add('Decoding', loadcode, valwrapper, inputs)
+                    timer.add('Mapper', mapper, mapcleanup, mapfunc_iter)
+                    timer.add('Combiner sort', sorted, mergesorted, SpillFile)
+                    timer.add('Combiner', combiner, combcleanup,
+                              iterhashcombine, iterreduce, redfunc_iter)
+                    timer.add('Encoding', dumpcode)
+                    timer.add('Writing output', run.func_code)
+                    inputs = timer.count('Input records', inputs)
                 if os.environ.has_key('dumbo_addpath'):
                     path = runinfo.get_input_path()
                     inputs = (((path, k), v) for (k, v) in inputs)
@@ -313,8 +372,7 @@ def run(mapper,
                     if not modname:
                         raise ImportError(parser)
                     module = __import__(modname, fromlist=[clsname])
-                    parse = getattr(module, clsname)().parse
-                    outputs = itermap(inputs, mapper, parse)
+                    valfunc = getattr(module, clsname)().parse
                 elif os.environ.has_key('dumbo_record'):
                     record = os.environ['dumbo_record']
                     clsname = record.split('.')[-1]
@@ -323,37 +381,94 @@ def run(mapper,
                         raise ImportError(parser)
                     module = __import__(modname, fromlist=[clsname])
                     set = getattr(module, clsname)().set
-                    outputs = itermap(inputs, mapper, lambda v: set(*v))
+                    valfunc = lambda v: set(*v)
                 else:
-                    outputs = itermap(inputs, mapper)
-                if mapcleanup:
-                    outputs = chain(outputs, mapcleanup())
+                    valfunc = None
 
                 # Combiner
-                if combiner and type(combiner) != str:
-                    if (not buffersize) and memlim:
-                        buffersize = int(memlim * 0.33) / 512  # educated guess
-                        print >> sys.stderr, 'INFO: buffersize =', buffersize
-                    inputs = sorted(outputs, buffersize)
+                combining = os.environ.get('dumbo_combining')
+                if not combining:
+                    combining = 'hash' if associative else 'sort'
+                if combining == 'hash' and os.environ.has_key('dumbo_joinkeys'):
+                    combining = 'sort'  # join keys need to be sorted
+                if combiner and combining != 'hash' and \
+                (not buffersize) and memlim and not memory:
+                    buffersize = int(memlim * 0.33) / 512  # educated guess
+                    print >> sys.stderr, 'INFO: buffersize =', buffersize
+
+                def combine(outputs, keyfunc=None):
+                    if combining == 'hash':
+                        print >> sys.stderr, 'INFO: hash combining'
+                        maxentries = int(os.environ.get('dumbo_combinerentries',
+                                                        HASHCOMBINE_MAXENTRIES))
+                        maxbytes = os.environ.get('dumbo_combinerbytes')
+                        if maxbytes:
+                            maxbytes = parsebytes(maxbytes)
+                        elif memlim and not memory:
+                            maxbytes = int(memlim * 0.33)  # educated guess
+                        return iterhashcombine(outputs, combiner,
+                            maxentries=maxentries, maxbytes=maxbytes,
+                            evict=os.environ.get('dumbo_combinerevict', 'lru'),
+                            associative=associative, memory=memory)
+                    inputs = sorted(outputs, buffersize, memory=memory)
+                    return iterreduce(inputs, combiner, keyfunc=keyfunc)
+
+                def mapoutputs(inputs):
+                    if memory:  # enforce the hard limit
+                        inputs = memory.watch(inputs)
+                    outputs = itermap(inputs, mapper, valfunc)
+                    if mapcleanup:
+                        outputs = chain(outputs, mapcleanup())
+                    if samplerate:
+                        outputs = ((key, None) for (key, _) in outputs)
+                    if timer:
+                        outputs = timer.count('Map output records', outputs)
+                    if combiner and type(combiner) != str:
+                        outputs = combine(outputs)
+                        if timer:
+                            outputs = timer.count('Combine output records',
+                                                  outputs)
                     if os.environ.has_key('dumbo_joinkeys'):
-                        outputs = iterreduce(inputs, combiner,
-                                             keyfunc=jk_class.fromjoinkey)
-                    else:
-                        outputs = iterreduce(inputs, combiner)
-                if os.environ.has_key('dumbo_joinkeys'):
-                    outputs = ((jk.dump(), v) for (jk, v) in outputs)
-                if combcleanup:
-                    outputs = chain(outputs, combcleanup())
+                        outputs = ((jk.dump(), v) for (jk, v) in outputs)
+                    if combcleanup:
+                        outputs = chain(outputs, combcleanup())
+                    return outputs
+
+                mapprocs = int(os.environ.get('dumbo_mapprocs', 1))
+                if mapprocs > 1:
+                    print >> sys.stderr, 'INFO: mapping in', mapprocs, 'processes'
+                    outputs = iterforkmap(inputs, mapoutputs, mapprocs,
+                                          closefuncs=(combclose, mapclose))
+                    if combiner and type(combiner) != str and associative:
+                        # merge what the workers combined separately
+                        if os.environ.has_key('dumbo_joinkeys'):
+                            outputs = combine(outputs, jk_class.fromdump)
+                            outputs = ((jk.dump(), v) for (jk, v) in outputs)
+                        else:
+                            outputs = combine(outputs)
+                    combclose = mapclose = None  # the workers closed them
+                else:
+                    outputs = mapoutputs(inputs)
+                if os.environ.has_key('dumbo_secondarysort'):
+                    outputs = ((secondarysortkey(k), v) for (k, v) in outputs)
 
+                if timer:
+                    timer.start()
                 if os.environ.has_key('stream_map_output') and \
                 os.environ['stream_map_output'].lower() == 'typedbytes':
                     print >> sys.stderr, "INFO: outputting typed bytes"
                     try: import ctypedbytes as typedbytes
                     except ImportError: import typedbytes
                     typedbytes.PairedOutput(sys.stdout).writes(outputs)
+                elif timer:
+                    timer.writelines(('\t'.join(output) for output in
+                                      dumpcode(outputs, codec)), sys.stdout)
                 else:
-                    for output in dumpcode(outputs):
+                    for output in dumpcode(outputs, codec):
                         print '\t'.join(output)
+                if timer:
+                    timer.stop()
+                    timer.report()
                 if combclose:
                     combclose()
                 if mapclose:
@@ -361,6 +476,8 @@ def run(mapper,
 
             elif reducer:
                 # Reducer
+                if os.environ.has_key('dumbo_splits'):  # for -totalorder
+                    reducer = splitsreducer(int(os.environ['dumbo_splits']))
                 if type(reducer) in (types.ClassType, type):
                     reducercls = type('DumboReducer', (reducer, mrbase_class), {})
                     reducer = reducercls()
@@ -378,31 +495,67 @@ def run(mapper,
                     try: import ctypedbytes as typedbytes
                     except ImportError: import typedbytes
                     inputs = typedbytes.PairedInput(sys.stdin).reads()
+                elif timer:
+                    inputs = loadcode(timer.readlines(sys.stdin), codec)
                 else:
-                    inputs = loadcode(line[:-1] for line in sys.stdin)
+                    inputs = loadcode((line[:-1] for line in sys.stdin), codec)
                 if redconf:
                     redconf()
+                if timer:
+                    timer.add('Decoding', loadcode, inputs)
+                    timer.add('Reduce grouping', iterreduce, iterhashreduce)
+                    timer.add('Reducer', reducer, redcleanup, redfunc_iter)
+                    timer.add('Encoding', dumpcode)
+                    timer.add('Writing output', run.func_code)
+                    inputs = timer.count('Input records', inputs)
+                if memory:  # enforce the hard limit
+                    inputs = memory.watch(inputs)
                 if os.environ.has_key('dumbo_joinkeys'):
                     outputs = iterreduce(inputs, reducer,
                                          keyfunc=jk_class.fromdump)
                     outputs = ((jk.body, v) for (jk, v) in outputs)
+                elif os.environ.has_key('dumbo_secondarysort'):
+                    outputs = iterreduce(inputs, reducer, groupkey=itemgetter(1))
+                elif os.environ.get('dumbo_reducegrouping') == 'hash':
+                    print >> sys.stderr, 'INFO: hash grouping'
+                    maxbytes = HASHREDUCE_MAXBYTES
+                    if memory:
+                        maxbytes = None
+                    elif memlim:
+                        maxbytes = int(memlim * 0.33)  # educated guess
+                    outputs = iterhashreduce(inputs, reducer, maxbytes=maxbytes,
+                                             memory=memory)
                 else:
                     outputs = iterreduce(inputs, reducer)
                 if redcleanup:
                     outputs = chain(outputs, redcleanup())
+                manifest = None
+                if os.environ.has_key('dumbo_manifest'):
+                    manifest = [None, None, 0]
+                    outputs = itermanifest(outputs, manifest)
+                if timer:
+                    timer.start()
                 if os.environ.has_key('stream_reduce_output') and \
                 os.environ['stream_reduce_output'].lower() == 'typedbytes':
                     print >> sys.stderr, "INFO: outputting typed bytes"
                     try: import ctypedbytes as typedbytes
                     except ImportError: import typedbytes
                     typedbytes.PairedOutput(sys.stdout).writes(outputs)
+                elif timer:
+                    timer.writelines(('\t'.join(output) for output in
+                                      dumpcode(outputs, codec)), sys.stdout)
                 else:
-                    for output in dumpcode(outputs):
+                    for output in dumpcode(outputs, codec):
                         print '\t'.join(output)
+                if timer:
+                    timer.stop()
+                    timer.report()
+                if manifest:
+                    savemanifest(manifest, codec)
                 if redclose:
                     redclose()
             else:
-                for output in dumpcode(inputs):
+                for output in dumpcode(inputs, codec):
                     print '\t'.join(output)
     else:
         opts = Options(opts)
@@ -459,7 +612,15 @@ def run(mapper,
                      getclassname(backend.get_joinkey_class(opts)))
         opts.add('cmdenv', 'dumbo_runinfo_class=' + \
                      getclassname(backend.get_runinfo_class(opts)))
+        totalorderopt = opts.pop('totalorder')
+        splitspath = None
+        if reducer and totalorderopt and 'no' not in totalorderopt:
+            splitspath = samplesplits(backend, fs, opts, output,
+                                      totalorderopt[0])
+            opts.add('totalorder', splitspath)
         retval = backend.create_iteration(opts).run()
+        if splitspath:
+            fs.rm(splitspath, opts)
         if retval == 127:
             print >> sys.stderr, 'ERROR: Are you sure that "python" is on your path?'
         if retval != 0:
@@ -497,21 +658,423 @@ def itermap(data, mapfunc, valfunc=None):
         return mapfunc_iter(data, mapfunc)
 
 
+FORKMAP_BATCHSIZE = 256
+
+
+def _loadbatches(file):
+    while True:
+        try:
+            batch = cPickle.load(file)
+        except EOFError:
+            return
+        for record in batch:
+            yield record
+
+
+def retryinterrupted(func, *args):
+    """
+    Calls func again when a signal, like the ones the -timing sampler
+    relies on, interrupts the system call it makes
+    """
+    while True:
+        try:
+            return func(*args)
+        except (select.error, EnvironmentError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+def iterforkmap(data, mapfunc, procs, closefuncs=()):
+    """
+    Spreads data over procs forked worker processes that apply mapfunc to
+    their share, and yields the outputs of all workers once they are done.
+    The workers inherit the configured state of the calling process, and
+    call closefuncs before exiting.
+    """
+    flushcounters()  # or the workers would report them again
+    sys.stdout.flush()
+    sys.stderr.flush()
+    workers = []
+    for i in xrange(procs):
+        (rfd, wfd) = os.pipe()
+        outfile = tempfile.TemporaryFile()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            profiling.forkedtask()
+            try:
+                os.close(wfd)
+                for (_, pipe, _) in workers:
+                    pipe.close()
+                outputs = iter(mapfunc(_loadbatches(os.fdopen(rfd, 'rb'))))
+                batch = list(islice(outputs, FORKMAP_BATCHSIZE))
+                while batch:
+                    cPickle.dump(batch, outfile, 2)
+                    batch = list(islice(outputs, FORKMAP_BATCHSIZE))
+                for closefunc in closefuncs:
+                    if closefunc:
+                        closefunc()
+                outfile.flush()
+            except:
+                traceback.print_exc()
+                status = 1
+            profiling.finishtask()  # os._exit skips the atexit handlers
+            flushcounters()
+            sys.stderr.flush()
+            os._exit(status)
+        os.close(rfd)
+        workers.append((pid, os.fdopen(wfd, 'wb'), outfile))
+
+    try:
+        pipes = [pipe for (_, pipe, _) in workers]
+        data = iter(data)
+        batch = list(islice(data, FORKMAP_BATCHSIZE))
+        turn = 0
+        while batch:
+            ready = retryinterrupted(select.select, [], pipes, [])[1]
+            pipe = ready[turn % len(ready)]
+            try:
+                pipe.write(cPickle.dumps(batch, 2))
+                pipe.flush()
+            except IOError:
+                break  # a worker died, which gets reported below
+            turn += 1
+            batch = list(islice(data, FORKMAP_BATCHSIZE))
+    finally:
+        for (_, pipe, _) in workers:
+            try:
+                pipe.close()
+            except IOError:
+                pass
+    failed = 0
+    for (pid, _, _) in workers:
+        if retryinterrupted(os.waitpid, pid, 0)[1] != 0:
+            failed += 1
+    if failed:
+        raise Error('%d of %d map processes failed' % (failed, procs))
+
+    for (_, _, outfile) in workers:
+        outfile.seek(0)
+        for output in _loadbatches(outfile):
+            yield output
+        outfile.close()
+
+
 def redfunc_iter(data, redfunc):
     for (key, values) in data:
         for output in redfunc(key, values):
             yield output
 
 
-def iterreduce(data, redfunc, keyfunc=None):
+def applyreduce(data, redfunc):
+    try:
+        return redfunc(data)
+    except TypeError:
+        return redfunc_iter(data, redfunc)
+
+
+def iterreduce(data, redfunc, keyfunc=None, groupkey=None):
+    if groupkey:  # group on part of the key only
+        data = ((groupkey(k), v) for (k, v) in data)
     data = groupby(data, itemgetter(0))
     data = ((key, (v[1] for v in values)) for key, values in data)
     if keyfunc:
         data = ((keyfunc(key), values) for key, values in data)
+    return applyreduce(data, redfunc)
+
+
+def sortablefield(value):
+    """
+    Encodes numbers (also within tuples) as fixed-width hex strings that
+    sort like the numbers themselves, both as text and as typed bytes.
+    Other values cannot be supported since typed bytes strings start with
+    their length, which makes Hadoop sort them by length first.
+    """
+    if type(value) in (int, long, float, bool):
+        (bits, ) = struct.unpack('>Q', struct.pack('>d', value))
+        if bits >> 63:
+            bits ^= 0xffffffffffffffff  # negative
+        else:
+            bits ^= 0x8000000000000000
+        return '%016x' % bits
+    if type(value) is tuple:
+        return tuple(sortablefield(v) for v in value)
+    raise TypeError('-secondarysort needs numbers or tuples of numbers as '
+                    'sort fields, not %r' % (value, ))
+
+
+def secondarysortkey(key):
+    """
+    Turns a (group, sortfield) key into the (hash, group, sortfield) key
+    that gets shuffled for -secondarysort. The hash is what the reducers
+    get assigned by, and it always has the same position and size in the
+    typed bytes encoding of the key.
+    """
+    (group, sortfield) = key
+    return (crc32(repr(group)) & 0x7fffffff, group, sortablefield(sortfield))
+
+
+TOTALORDER_SAMPLERATE = 0.01
+
+
+def samplesplits(backend, fs, opts, output, samplerate):
+    """
+    Runs a job that samples the map output keys and picks the split points
+    for -totalorder, and returns the path of its output
+    """
+    partitions = opts['numreducetasks'] or opts['localprocs']
+    if not partitions:
+        print >> sys.stderr, 'ERROR: -totalorder needs -numreducetasks'
+        sys.exit(1)
+    if samplerate == 'yes':
+        samplerate = TOTALORDER_SAMPLERATE
+    splitspath = output + '_splits'
+    sampleopts = Options(opts)
+    sampleopts.remove('output', 'numreducetasks', 'outputformat', 'delinputs',
+                      'combiner', 'profile', 'timing')
+    sampleopts.add('output', splitspath)
+    sampleopts.add('numreducetasks', '1')
+    sampleopts.add('outputformat', 'sequencefile')
+    sampleopts.add('delinputs', 'no')
+    sampleopts.add('cmdenv', 'dumbo_samplerate=%s' % samplerate)
+    sampleopts.add('cmdenv', 'dumbo_splits=%s' % partitions[0])
+    fs.rm(splitspath, opts)
+    retval = backend.create_iteration(sampleopts).run()
+    if retval != 0:
+        print >> sys.stderr, 'ERROR: Sampling for -totalorder failed'
+        sys.exit(retval)
+    return splitspath
+
+
+def itersample(data, rate):
+    rand = random.random
+    return (item for item in data if rand() < rate)
+
+
+def picksplits(counts, partitions):
+    """
+    Picks the keys that divide the given sorted (key, count) pairs in the
+    given number of partitions of about equal total count. Every split key
+    is the first key of a partition, and they are all distinct.
+    """
+    (keys, starts, total) = ([], [], 0)
+    for (key, count) in counts:
+        keys.append(key)
+        starts.append(total)
+        total += count
+    (splits, last) = ([], 0)
+    for i in xrange(1, partitions):
+        target = i * total / float(partitions)
+        pos = bisect_left(starts, target)
+        if pos == len(keys) or \
+        (pos > 0 and target - starts[pos - 1] < starts[pos] - target):
+            pos -= 1  # the previous key starts closer to the target
+        pos = min(max(pos, last + 1), len(keys) - (partitions - i))
+        if pos <= last:
+            print >> sys.stderr, 'WARNING: too few distinct keys sampled ' \
+                                 'for %i partitions' % partitions
+            break
+        splits.append(keys[pos])
+        last = pos
+    return splits
+
+
+def splitsreducer(partitions):
+    """Returns a reducer that outputs the split keys for a sorted sample"""
+    def reducer(data):
+        counts = ((key, sum(1 for _ in values)) for (key, values) in data)
+        for key in picksplits(counts, partitions):
+            yield key, None
+    return reducer
+
+
+def itermanifest(outputs, manifest):
+    """Keeps track of the first and last key and the number of outputs"""
+    for output in outputs:
+        if not manifest[2]:
+            manifest[0] = output[0]
+        manifest[2] += 1
+        yield output
+    if manifest[2]:
+        manifest[1] = output[0]
+
+
+def savemanifest(manifest, codec=None):
+    """Saves the first and last key of this reduce task's output part"""
+    if os.environ.has_key('dumbo_part'):
+        part = os.environ['dumbo_part']
+    else:
+        taskid = os.environ.get('mapred_task_id') or \
+                 os.environ['mapreduce_task_attempt_id']
+        part = 'part-%05i' % int(taskid.split('_')[-2])
+    dirpath = os.environ.get('dumbo_manifestdir') or \
+              os.environ['mapred_work_output_dir']
+    (fd, path) = tempfile.mkstemp(suffix='.manifest')
     try:
-        return redfunc(data)
-    except TypeError:
-        return redfunc_iter(data, redfunc)
+        line = '\t'.join(dumpcode([(part, tuple(manifest))], codec).next())
+        os.write(fd, line + '\n')
+        os.close(fd)
+        savefile(path, dirpath, '_manifest-' + part)
+    finally:
+        os.remove(path)
+
+
+HASHCOMBINE_MAXENTRIES = 100000
+HASHCOMBINE_COLLAPSE = 16
+
+
+def iterhashcombine(data, redfunc, maxentries=HASHCOMBINE_MAXENTRIES,
+                    maxbytes=None, evict='lru', associative=False, memory=None):
+    """
+    Combines unsorted (key, value) pairs by buffering the values per key
+    in a dict. Half of the keys (and at least one) get flushed through the
+    combiner whenever the dict holds more than maxentries keys or roughly
+    maxbytes bytes, or when the memory manager reports pressure, picking
+    either the least recently used or the largest entries. For
+    associative combiners (i.e. the outputs can be fed to the combiner
+    again) the buffered values of a key also get collapsed regularly.
+    """
+    entries = {}  # key -> [last use, size in bytes, values]
+    (tick, nbytes, getsizeof) = (0, 0, sys.getsizeof)
+
+    def combine(groups):
+        return applyreduce(((k, iter(vs)) for k, vs in groups), redfunc)
+
+    def flush(all=False):
+        count = max(len(entries) / 2, 1)
+        if all:
+            keys = entries.keys()
+        elif evict == 'largest':
+            keys = heapq.nlargest(count, entries, key=lambda k: entries[k][1])
+        else:  # least recently used
+            keys = heapq.nsmallest(count, entries, key=lambda k: entries[k][0])
+        groups = [(key, entries.pop(key)[2]) for key in keys]
+        if not all:
+            incrcounter('Dumbo', 'Combiner evictions', len(groups))
+        return combine(groups)
+
+    for key, value in data:
+        tick += 1
+        if memory and entries and memory.pressure():
+            for output in flush():
+                yield output
+            nbytes = sum(entry[1] for entry in entries.itervalues())
+            memory.released()
+        try:
+            entry = entries[key]
+        except KeyError:
+            size = getsizeof(key) + getsizeof(value)
+            entries[key] = [tick, size, [value]]
+            nbytes += size
+        except TypeError:  # unhashable key
+            for output in combine([(key, [value])]):
+                yield output
+            continue
+        else:
+            size = getsizeof(value)
+            (entry[0], entry[1]) = (tick, entry[1] + size)
+            nbytes += size
+            values = entry[2]
+            values.append(value)
+            if associative and len(values) >= HASHCOMBINE_COLLAPSE:
+                collapsed = []
+                for output in combine([(key, values)]):
+                    if output[0] == key:
+                        collapsed.append(output[1])
+                    else:
+                        yield output
+                size = getsizeof(key) + sum(getsizeof(v) for v in collapsed)
+                nbytes += size - entry[1]
+                (entry[1], entry[2]) = (size, collapsed)
+        # a single key that keeps growing has to be flushed as well
+        if len(entries) > maxentries or (maxbytes and nbytes > maxbytes):
+            for output in flush():
+                yield output
+            nbytes = sum(entry[1] for entry in entries.itervalues())
+    for output in flush(all=True):
+        yield output
+
+
+HASHREDUCE_MAXBYTES = 256 * 1024 * 1024
+HASHREDUCE_BUCKETS = 64
+HASHREDUCE_MAXDEPTH = 3
+
+
+def iterhashreduce(data, redfunc, maxbytes=HASHREDUCE_MAXBYTES, memory=None,
+                   depth=0):
+    """
+    Groups unsorted (key, value) pairs in a dict instead of sorting them,
+    and reduces the groups in no particular order. When the dict holds
+    more than roughly maxbytes bytes or the memory manager reports
+    pressure, all pairs get partitioned over bucket files by key hash and
+    each bucket gets grouped separately. Buckets that remain too large
+    after a few rounds of this get sorted instead.
+    """
+    (groups, unhashable) = ({}, [])
+    (nbytes, getsizeof) = (0, sys.getsizeof)
+    data = iter(data)
+    for key, value in data:
+        try:
+            values = groups.get(key)
+        except TypeError:  # unhashable key
+            unhashable.append((key, value))
+            continue
+        if values is None:
+            values = groups[key] = []
+            nbytes += getsizeof(key)
+        values.append(value)
+        nbytes += getsizeof(value)
+        if (maxbytes and nbytes > maxbytes) or \
+        (memory and memory.pressure()):
+            break
+    else:
+        data = ((key, iter(values)) for (key, values) in groups.iteritems())
+        for output in applyreduce(data, redfunc):
+            yield output
+        for output in iterreduce(sorted(unhashable), redfunc):
+            yield output
+        return
+
+    (buckets, pending) = ([], [[] for _ in xrange(HASHREDUCE_BUCKETS)])
+    for _ in xrange(HASHREDUCE_BUCKETS):
+        buckets.append(SpillFile())
+
+    def add(key, value):
+        bucket = hash((depth, key)) % HASHREDUCE_BUCKETS
+        records = pending[bucket]
+        records.append((key, value))
+        if len(records) >= SPILL_BATCHSIZE:
+            buckets[bucket].extend(records)
+            del records[:]
+
+    for (key, values) in groups.iteritems():
+        for value in values:
+            add(key, value)
+    groups.clear()
+    for key, value in data:
+        try:
+            add(key, value)
+        except TypeError:  # unhashable key
+            unhashable.append((key, value))
+    for (bucket, records) in zip(buckets, pending):
+        bucket.extend(records)
+    incrcounter('Dumbo', 'Reduce grouping spills', 1)
+    incrcounter('Dumbo', 'Reduce grouping spilled bytes',
+                sum(bucket.nbytes for bucket in buckets))
+    if memory:
+        memory.released()
+
+    for bucket in buckets:
+        if depth + 1 < HASHREDUCE_MAXDEPTH:
+            outputs = iterhashreduce(bucket, redfunc, maxbytes, memory,
+                                     depth + 1)
+        else:  # probably a few huge groups, hashing does not help
+            outputs = iterreduce(sorted(bucket, memory=memory), redfunc)
+        for output in outputs:
+            yield output
+        bucket.close()
+    for output in iterreduce(sorted(unhashable), redfunc):
+        yield output
 
 
 def itermapred(data, mapfunc, redfunc):
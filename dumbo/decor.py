@@ -14,7 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from dumbo.lib import PrimaryMapper, SecondaryMapper
+from dumbo.lib import PrimaryMapper, SecondaryMapper, TableMapper, \
+    BlockMapper, ArrayReducer, SpillableReducer
 from dumbo.util import Options
 
 class opt(object):
@@ -31,8 +32,39 @@ class opt(object):
         return func
 
 
+class blockmapper(object):
+
+    def __init__(self, blocksize=1024, arrays=False, blockoutput=False):
+        self.args = (blocksize, arrays, blockoutput)
+
+    def __call__(self, mapper):
+        return BlockMapper(mapper, *self.args)
+
+
+def arrayreducer(reducer):
+    """Makes a reducer get the values for each key as a NumPy array"""
+    return ArrayReducer(reducer)
+
+
+def spillable(reducer):
+    """Makes a reducer get the values for each key as SpillableValues"""
+    return SpillableReducer(reducer)
+
+
+def associative(combiner):
+    """Marks a combiner whose outputs can be fed to it again"""
+    combiner.associative = True
+    return combiner
+
+
 def primary(mapper):
     return PrimaryMapper(mapper)
 
 def secondary(mapper):
     return SecondaryMapper(mapper)
+
+def table(tag):
+    """Marks a mapper for the table with the given tag in an n-way join"""
+    def decorator(mapper):
+        return TableMapper(mapper, tag)
+    return decorator
@@ -16,12 +16,22 @@
 
 import heapq
 import os
+import sys
+import re
+import random
 import types
-from itertools import chain, imap, izip
+import fnmatch
+from itertools import chain, imap, izip, islice, product
 from math import sqrt
-from copy import copy
 
-from dumbo.util import loadclassname, Options
+from dumbo.util import loadclassname, loadcode, incrcounter, getcodec, \
+    expandpaths, parsebytes, SpillFile, Options
+from dumbo.lib.cdbfile import CDBFile
+from dumbo.lib.bloomfilter import BloomFilter, BloomFilterMapper, \
+    bloomfilterreducer
+from dumbo.lib.sketches import HyperLogLog, HLLMapper, hllcombiner, \
+    hllreducer, KLLSketch, quantilecombiner, quantilereducer, SpaceSaving, \
+    TopKMapper, topkcombiner, topkreducer, skewedkeyreducer
 
 
 def identitymapper(key, value):
@@ -35,10 +45,12 @@ def identityreducer(key, values):
 
 def sumreducer(key, values):
     yield (key, sum(values))
+sumreducer.associative = True
 
 
 def sumsreducer(key, values):
     yield (key, tuple(imap(sum, izip(*values))))
+sumsreducer.associative = True
 
 
 def nlargestreducer(n, key=None):
@@ -89,6 +101,13 @@ def statscombiner(key, values):
 
 
 class MultiMapper(object):
+    """
+    Runs different mappers depending on the input path. By default, a
+    mapper applies to all paths that contain its pattern, but patterns can
+    also be glob patterns (matched against the full path) or regular
+    expressions (searched for in the path). The mappers that apply to a
+    path are looked up only once per path.
+    """
 
     def __new__(cls):
         if os.environ.get("dumbo_joinkeys", "no") == "yes":
@@ -100,11 +119,12 @@ class MultiMapper(object):
     def __init__(self):
         self.mappers = []
         self.opts = Options([("addpath", "iter")])
+        self.dispatch = {}
 
     def configure(self):
         mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
         mappers, closefuncs = [], []
-        for pattern, mapper in self.mappers:
+        for matches, mapper in self.mappers:
             if type(mapper) in (types.ClassType, type):
                 mappercls = type('DumboMapper', (mapper, mrbase_class), {})
                 mapper = mappercls()
@@ -114,48 +134,274 @@ class MultiMapper(object):
                 mapper.configure()
             if hasattr(mapper, 'close'):
                 closefuncs.append(mapper.close)
-            mappers.append((pattern, mapper))
+            mappers.append((matches, mapper))
         self.mappers = mappers
         self.closefuncs = closefuncs
+        self.dispatch = {}
 
     def close(self):
         for closefunc in self.closefuncs:
             closefunc()
 
+    def getmappers(self, path):
+        """Returns the mappers that apply to the given path"""
+        mappers = self.dispatch.get(path)
+        if mappers is None:
+            mappers = tuple(mapper for (matches, mapper) in self.mappers
+                            if matches(path))
+            self.dispatch[path] = mappers
+        return mappers
+
     def __call__normalkey(self, data):
-        mappers = self.mappers
-        for key, value in data:
-            path, key = key
-            for pattern, mapper in mappers:
-                if pattern in path:
-                    for output in mapper(key, value):
-                        yield output
+        (lastpath, mappers) = (None, ())
+        for (path, key), value in data:
+            if path != lastpath:
+                (lastpath, mappers) = (path, self.getmappers(path))
+            for mapper in mappers:
+                for output in mapper(key, value):
+                    yield output
 
     def __call__joinkey(self, data):
-        mappers = self.mappers
+        (lastpath, mappers) = (None, ())
         for key, value in data:
-            path = key.body[0]
-            key.body = key.body[1]
-            for pattern, mapper in mappers:
-                if pattern in path:
+            (path, body) = key.body
+            if path != lastpath:
+                (lastpath, mappers) = (path, self.getmappers(path))
+            if mappers:
+                key = key.withbody(body)
+                for mapper in mappers:
                     for output in mapper(key, value):
                         yield output
 
-    def add(self, pattern, mapper):
-        self.mappers.append((pattern, mapper))
+    def add(self, pattern, mapper, match='substring'):
+        """
+        Adds a mapper for the input paths that match pattern, where match
+        is 'substring', 'glob' or 'regex'.
+        """
+        if match == 'substring':
+            matches = lambda path: pattern in path
+        elif match == 'glob':
+            matches = re.compile(fnmatch.translate(pattern)).match
+        elif match == 'regex':
+            matches = re.compile(pattern).search
+        else:
+            raise ValueError('invalid match type: %s' % match)
+        self.mappers.append((matches, mapper))
+        self.dispatch = {}
         if hasattr(mapper, 'opts'):
             self.opts += mapper.opts
 
 
-class JoinMapper(object):
+class BlockMapper(object):
+    """
+    Feeds a mapper blocks of records instead of individual ones. The mapper
+    gets called with a list of keys and a list of values (or NumPy arrays
+    when arrays is True) and yields (key, value) pairs, or (keys, values)
+    blocks when blockoutput is True. The -blocksize option overrides the
+    default number of records per block.
+    """
 
-    def __init__(self, mapper, isprimary=False):
+    def __init__(self, mapper, blocksize=1024, arrays=False, blockoutput=False):
+        self.mapper = mapper
+        self.blocksize = blocksize
+        self.arrays = arrays
+        self.blockoutput = blockoutput
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+        if 'dumbo_blocksize' in os.environ:
+            self.blocksize = int(os.environ['dumbo_blocksize'])
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, blocksize) = (self.mapper, self.blocksize)
+        if self.arrays:
+            from numpy import asarray
+        data = iter(data)
+        block = list(islice(data, blocksize))
+        while block:
+            keys = [key for key, value in block]
+            values = [value for key, value in block]
+            del block
+            if self.arrays:
+                (keys, values) = (asarray(keys), asarray(values))
+            outputs = mapper(keys, values) or ()
+            if self.blockoutput:
+                for outkeys, outvalues in outputs:
+                    for output in izip(outkeys, outvalues):
+                        yield output
+            else:
+                for output in outputs:
+                    yield output
+            block = list(islice(data, blocksize))
+
+
+class ArrayReducer(object):
+    """
+    Calls a reducer with the values for each key as a NumPy array instead
+    of an iterator, so it can use vectorized operations on them.
+    """
+
+    def __init__(self, reducer, dtype=None):
+        (self.reducer, self.dtype) = (reducer, dtype)
+        self.associative = getattr(reducer, 'associative', False)
+        self.opts = Options()
+        if hasattr(reducer, 'opts'):
+            self.opts += reducer.opts
+
+    def __call__(self, key, values):
+        from numpy import array
+        return self.reducer(key, array(list(values), dtype=self.dtype))
+
+
+SPILLABLE_MAXBYTES = 64 * 1024 * 1024
+
+
+class SpillableValues(object):
+    """
+    Sequence of values that can be iterated over several times. The values
+    are kept in memory up to roughly maxbytes bytes and transparently get
+    spilled to a temporary file beyond that. The -spillbytes option
+    overrides the default budget.
+    """
+
+    def __init__(self, values=(), maxbytes=None):
+        if maxbytes is None:
+            maxbytes = parsebytes(os.environ.get('dumbo_spillbytes',
+                                                 SPILLABLE_MAXBYTES))
+        self.maxbytes = maxbytes
+        (self.values, self.nbytes, self.spillfile) = ([], 0, None)
+        self.extend(values)
+
+    def extend(self, values):
+        spillfile = self.spillfile
+        if spillfile is not None:
+            nbytes = spillfile.nbytes
+            spillfile.extend(values)
+            incrcounter('Dumbo', 'Spilled value bytes',
+                        spillfile.nbytes - nbytes)
+            return
+        (buffered, getsizeof) = (self.values, sys.getsizeof)
+        (nbytes, maxbytes) = (self.nbytes, self.maxbytes)
+        values = iter(values)
+        for value in values:
+            buffered.append(value)
+            nbytes += getsizeof(value)
+            if nbytes > maxbytes:
+                self.spill(values)
+                return
+        self.nbytes = nbytes
+
+    def spill(self, values):
+        self.spillfile = SpillFile(chain(self.values, values))
+        (self.values, self.nbytes) = (None, 0)
+        incrcounter('Dumbo', 'Spilled groups', 1)
+        incrcounter('Dumbo', 'Spilled value bytes', self.spillfile.nbytes)
+
+    @property
+    def spilled(self):
+        return self.spillfile is not None
+
+    def __len__(self):
+        if self.spillfile is not None:
+            return len(self.spillfile)
+        return len(self.values)
+
+    def __iter__(self):
+        if self.spillfile is not None:
+            return iter(self.spillfile)
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        if self.spillfile is None:
+            return self.values[index]
+        if index < 0:
+            index += len(self.spillfile)
+        if index >= 0:
+            for value in islice(self.spillfile, index, None):
+                return value
+        raise IndexError('index out of range')
+
+    def close(self):
+        if self.spillfile is not None:
+            self.spillfile.close()
+
+
+class SpillableReducer(object):
+    """
+    Calls a reducer with the values for each key as SpillableValues, for
+    reducers that need to go over the values more than once
+    """
+
+    def __init__(self, reducer, maxbytes=None):
+        (self.reducer, self.maxbytes) = (reducer, maxbytes)
+        self.opts = Options()
+        if hasattr(reducer, 'opts'):
+            self.opts += reducer.opts
+
+    def __call__(self, key, values):
+        values = SpillableValues(values, self.maxbytes)
+        try:
+            for output in self.reducer(key, values) or ():
+                yield output
+        finally:
+            values.close()
+
+
+JOIN_SALTS = 16
+JOIN_MAXTABLES = 9  # tags sort as text on the unix backend
+HOTKEY_SAMPLERATE = 0.01
+
+
+class JoinMapper(object):
+    """
+    Turns the output keys of a mapper into join keys. When a bloom filter
+    (as built by BloomFilterMapper) is given as cache file, outputs with
+    keys that are not in it get dropped.
+
+    Secondary outputs for the given hot keys get spread over salts salted
+    keys, and primary outputs for these keys get replicated to all of
+    them, so that no single reducer has to join all records for a hot
+    key. The hot keys can be given as a list or as a cache file (as
+    output by a job that uses HotKeySampler), and both sides of the join
+    need the same hot keys and number of salts.
+    """
+
+    def __init__(self, mapper, isprimary=False, bloomfilter=None,
+                 hotkeys=None, salts=JOIN_SALTS):
         self.mapper = mapper
         self.isprimary = isprimary
+        self.tag = 2 - int(isprimary)
+        self.bloomfilter = bloomfilter
+        (self.hotkeys, self.salts) = (hotkeys, salts)
         self.opts = Options([('joinkeys', 'yes')])
+        if bloomfilter:
+            self.opts.add('cachefile', cachefileopt(bloomfilter))
+        if type(hotkeys) == str:
+            self.opts.add('cachefile', cachefileopt(hotkeys))
         if hasattr(mapper, 'opts'):
             self.opts += self.mapper.opts
         self.closefunc = None
+        (self.filter, self.pruned) = (None, 0)
+        (self.hot, self.salt) = (None, 0)
 
     def configure(self):
         mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
@@ -170,49 +416,153 @@ class JoinMapper(object):
         if hasattr(mapper, 'close'):
             self.closefunc = mapper.close
         self.mapper = mapper
+        if self.bloomfilter:
+            self.filter = BloomFilter.load(cachedpath(self.bloomfilter))
+        if type(self.hotkeys) == str:
+            self.hot = loadhotkeys(cachedpath(self.hotkeys))
+        elif self.hotkeys:
+            self.hot = frozenset(self.hotkeys)
 
     def close(self):
+        if self.pruned:
+            incrcounter('Dumbo', 'Bloom filter pruned records', self.pruned)
         if self.closefunc:
             self.closefunc()
 
     def __call__(self, key, value):
-        key.isprimary = self.isprimary
+        (jk, bloomfilter, hot) = (type(key)(key.body, tag=self.tag),
+                                  self.filter, self.hot)
+        if bloomfilter is None and hot is None:
+            for k, v in self.mapper(key.body, value):
+                yield jk.withbody(k), v
+            return
         for k, v in self.mapper(key.body, value):
-            jk = copy(key)
-            jk.body = k
-            yield jk, v
+            if bloomfilter is not None and k not in bloomfilter:
+                self.pruned += 1
+            elif hot is not None and k in hot:
+                if self.isprimary:
+                    for salt in xrange(self.salts):
+                        yield type(key)(k, True, salt), v
+                else:
+                    self.salt = (self.salt + 1) % self.salts
+                    yield type(key)(k, False, self.salt), v
+            else:
+                yield jk.withbody(k), v
 
             
 class PrimaryMapper(JoinMapper):
 
-    def __init__(self, mapper):
-        JoinMapper.__init__(self, mapper, True)
+    def __init__(self, mapper, hotkeys=None, salts=JOIN_SALTS):
+        JoinMapper.__init__(self, mapper, True, None, hotkeys, salts)
 
 
 class SecondaryMapper(JoinMapper): 
 
-    def __init__(self, mapper):
-        JoinMapper.__init__(self, mapper, False)
+    def __init__(self, mapper, bloomfilter=None, hotkeys=None,
+                 salts=JOIN_SALTS):
+        JoinMapper.__init__(self, mapper, False, bloomfilter, hotkeys, salts)
+
+
+class TableMapper(JoinMapper):
+    """
+    Mapper for one of the tables of an NWayJoinReducer join, identified by
+    its tag. Tags go from 1 to 9, since the unix backend sorts them as text
+    and would put tag 10 before tag 2.
+    """
+
+    def __init__(self, mapper, tag, bloomfilter=None):
+        if not 1 <= tag <= JOIN_MAXTABLES:
+            raise ValueError('table tags have to be between 1 and %i, not %r'
+                             % (JOIN_MAXTABLES, tag))
+        JoinMapper.__init__(self, mapper, tag == 1, bloomfilter)
+        self.tag = tag
+
+
+class HotKeySampler(object):
+    """
+    Outputs (key, 1) for a random sample of the outputs of a mapper, for
+    finding the hot keys of a join with hotkeyreducer
+    """
+
+    def __init__(self, mapper, rate=HOTKEY_SAMPLERATE):
+        (self.mapper, self.rate) = (mapper, rate)
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, rate, rand) = (self.mapper, self.rate, random.random)
+        for key, value in data:
+            for k, v in mapper(key, value):
+                if rand() < rate:
+                    yield k, 1
+
+
+def hotkeyreducer(threshold, rate=HOTKEY_SAMPLERATE):
+    """Outputs the keys that occur about threshold times or more"""
+    def reducer(key, values):
+        estimate = sum(values) / rate
+        if estimate >= threshold:
+            yield key, int(estimate)
+    return reducer
+
+
+def loadhotkeys(path):
+    """Loads the keys from the given text or code output file(s)"""
+    codec = getcodec(os.environ.get('dumbo_codec'))
+    hotkeys = set()
+    for filepath in expandpaths([path]):
+        for line in open(filepath):
+            keytext = line[:-1].split('\t', 1)[0]
+            if not keytext:
+                continue
+            hotkeys.add(keytext)
+            try:
+                hotkeys.add(codec.loads(keytext))
+            except codec.errors:
+                pass  # text output
+    return frozenset(hotkeys)
 
 
 class JoinCombiner(object):
 
     opts = Options([("joinkeys", "yes")])
+    saltedprimaryoutputs = True
 
     def __call__(self, key, values):
         if key.isprimary:
             self._key = key.body
             output = self.primary(key.body, values)
-            if output:
+            if not output:
+                pass
+            elif key.salt and not self.saltedprimaryoutputs:
+                for _ in output:
+                    pass  # the replica for salt 0 outputs these already
+            else:
                 for k, v in output:
-                    jk = copy(key)
-                    jk.body = k
-                    yield jk, v
+                    yield key.withbody(k), v
         elif not self.secondary_blocked(key.body):
             for k, v in self.secondary(key.body, values):
-                jk = copy(key)
-                jk.body = k
-                yield jk, v
+                yield key.withbody(k), v
 
     def secondary_blocked(self, key_body):
         '''Determines if the secondary method should be blocked or not.'''
@@ -229,9 +579,219 @@ class JoinCombiner(object):
 
 class JoinReducer(JoinCombiner):
 
+    saltedprimaryoutputs = False
+
     def __init__(self):
         self._key = None
 
     def secondary_blocked(self, body):
         return self._key != body
 
+
+
+MAPSIDEJOIN_MAXBYTES = 256 * 1048576
+
+
+class MapSideJoinMapper(object):
+    """
+    Joins the outputs of a mapper with a small table that every map task
+    loads from a cache file, so that neither side needs to be shuffled.
+    Tables ending in .cdb are constant dbs (as generated by CDBReducer)
+    that get memory mapped, other tables are read into a dict from a text
+    file with tab separated keys and values, or from a code file when
+    format is 'code'. The outputs are (key, (tablevalue, value)) pairs,
+    or the outputs of joiner(key, tablevalue, value) when a joiner is
+    given. Keys that are not in the table get None as table value when
+    outer is True and are dropped otherwise.
+    """
+
+    def __init__(self, mapper, cachefile, format=None, joiner=None,
+                 outer=False):
+        self.mapper = mapper
+        self.cachefiles = [cachefile] if type(cachefile) == str else cachefile
+        self.format = format
+        self.joiner = joiner
+        self.outer = outer
+        self.opts = Options()
+        for path in self.cachefiles:
+            self.opts.add('cachefile', cachefileopt(path))
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+        self.tables = [loadtable(path, self.format) for path in self.cachefiles]
+
+    def close(self):
+        for table in self.tables:
+            if hasattr(table, 'close'):
+                table.close()
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, joiner, tables) = (self.mapper, self.joiner, self.tables)
+        (joined, misses) = (0, 0)
+        for key, value in data:
+            for k, v in mapper(key, value):
+                found = False
+                for table in tables:
+                    for tablevalue in table.getall(k):
+                        found = True
+                        joined += 1
+                        if joiner:
+                            for output in joiner(k, tablevalue, v):
+                                yield output
+                        else:
+                            yield k, (tablevalue, v)
+                if not found:
+                    misses += 1
+                    if self.outer:
+                        if joiner:
+                            for output in joiner(k, None, v):
+                                yield output
+                        else:
+                            yield k, (None, v)
+        incrcounter('Dumbo', 'Map-side join matches', joined)
+        incrcounter('Dumbo', 'Map-side join misses', misses)
+
+
+class DictTable(dict):
+    """Table that keeps a single value per key in a plain dict"""
+
+    def __init__(self, items):
+        dict.__init__(self)
+        self.extra = {}  # additional values for repeated keys
+        for key, value in items:
+            if key in self:
+                self.extra.setdefault(key, []).append(value)
+            else:
+                self[key] = value
+
+    def getall(self, key):
+        try:
+            yield self[key]
+        except (KeyError, TypeError):  # unhashable keys cannot match either
+            return
+        for value in self.extra.get(key, ()):
+            yield value
+
+
+def cachefileopt(path):
+    """Returns the -cachefile value that links path into the working dir"""
+    if '#' not in path:
+        path += '#' + os.path.basename(path)
+    return path
+
+
+def cachedpath(path):
+    """
+    Returns the path to open for a cache file, which is the symlink the
+    distributed cache created in the task's working directory if there is
+    one, and the given path otherwise (e.g. for the unix backend)
+    """
+    if '#' in path:
+        (path, name) = path.split('#', 1)
+    else:
+        name = os.path.basename(path)
+    if os.path.exists(name):
+        return name
+    return path
+
+
+def loadtable(path, format=None):
+    """Opens the given table from the distributed cache"""
+    path = cachedpath(path)
+    if format is None:
+        format = 'cdb' if path.endswith('.cdb') else 'text'
+    if format == 'cdb':
+        return CDBFile(path)
+    lines = (line[:-1] for line in open(path))
+    if format == 'code':
+        items = loadcode(lines, os.environ.get('dumbo_codec'))
+    else:
+        items = (line.split('\t', 1) for line in lines)
+    return DictTable((item[0], item[1] if len(item) > 1 else None)
+                     for item in items)
+
+
+def fitsmapsidejoin(program, path, maxbytes=MAPSIDEJOIN_MAXBYTES):
+    """
+    Tells a starter whether the table at path is small enough to be joined
+    on the map side, by comparing its size with maxbytes. The answer also
+    gets passed on as the mapsidejoin parameter (yes or no), so that the
+    runner can pick between a MapSideJoinMapper and a reduce-side join.
+    """
+    from dumbo.backends import create_filesystem
+    size = create_filesystem(program.opts).size(path, program.opts)
+    fits = size is not None and size <= maxbytes
+    program.addparam('mapsidejoin', 'yes' if fits else 'no')
+    return fits
+
+
+class NWayJoinReducer(object):
+    """
+    Joins the tables with tags 1 to tables, as output by TableMapper, in a
+    single pass. The values of all tables but the last one get buffered
+    for the current key as SpillableValues, and the values of the last
+    table are streamed through join(key, tablevalues, values), so the last
+    table should be the largest one. By default, join yields the inner
+    join of all tables with tuples of values.
+    """
+
+    opts = Options([("joinkeys", "yes")])
+
+    def __init__(self, tables):
+        if tables > JOIN_MAXTABLES:
+            raise ValueError('cannot join more than %i tables in one pass'
+                             % JOIN_MAXTABLES)
+        self.tables = tables
+        (self._key, self._tablevalues) = (None, None)
+
+    def __call__(self, key, values):
+        keyid = key[:-1]  # body and salt, if any
+        if keyid != self._key:
+            self._key = keyid
+            for tablevalues in self._tablevalues or ():
+                tablevalues.close()
+            self._tablevalues = [SpillableValues()
+                                 for _ in xrange(self.tables - 1)]
+        if key.tag < self.tables:
+            self._tablevalues[key.tag - 1].extend(values)
+        else:
+            output = self.join(key.body, self._tablevalues, values)
+            for k, v in output or ():
+                yield key.withbody(k), v
+
+    def join(self, key, tablevalues, values):
+        if not all(tablevalues):
+            return
+        if any(spillable.spilled for spillable in tablevalues):
+            joins = lambda: iterproduct(tablevalues)
+        else:
+            joins = lambda: product(*tablevalues)
+        for value in values:
+            for joined in joins():
+                yield key, joined + (value, )
+
+
+def iterproduct(sequences):
+    """Like itertools.product, but iterates over the sequences repeatedly"""
+    if not sequences:
+        yield ()
+        return
+    for value in sequences[0]:
+        for rest in iterproduct(sequences[1:]):
+            yield (value, ) + rest
@@ -0,0 +1,156 @@
+"""
+NumPy-backed aggregation of numeric values. AggregatingMapper buffers the
+mapper outputs for many keys in arrays and reduces each block with a few
+vectorized calls, so the combiners and reducers only have to merge small
+partial aggregates instead of iterating over every single value.
+"""
+
+import os
+import types
+
+import numpy
+
+from dumbo.util import loadclassname, Options
+
+AGGREGATE_BLOCKSIZE = 65536
+AGGREGATES = ('sum', 'min', 'max', 'stats')
+
+
+def pyvalue(value):
+    """Converts NumPy scalars and vectors to Python numbers and tuples"""
+    value = value.tolist()
+    if type(value) is list:
+        return tuple(value)
+    return value
+
+
+def aggregateblock(keys, values, aggregate='sum'):
+    """
+    Yields (key, partial aggregate) pairs for a block of keys and (scalar
+    or vector) values. The partial aggregate for 'stats' is a (n, sum(x),
+    sum(x**2), min, max) tuple, just like statscombiner outputs.
+    """
+    index = {}
+    codes = numpy.fromiter((index.setdefault(k, len(index)) for k in keys),
+                           numpy.intp, len(keys))
+    if not index:
+        return
+    order = codes.argsort(kind='mergesort')
+    values = numpy.asarray(values)[order]
+    codes = codes[order]
+    starts = numpy.flatnonzero(numpy.r_[True, codes[1:] != codes[:-1]])
+    groupkeys = [None] * len(index)
+    for (key, code) in index.iteritems():
+        groupkeys[code] = key
+    if aggregate == 'stats':
+        counts = numpy.diff(numpy.r_[starts, len(codes)])
+        sums = numpy.add.reduceat(values, starts, axis=0)
+        squares = numpy.add.reduceat(values * values, starts, axis=0)
+        mins = numpy.minimum.reduceat(values, starts, axis=0)
+        maxs = numpy.maximum.reduceat(values, starts, axis=0)
+        for (code, key) in enumerate(groupkeys):
+            yield key, (int(counts[code]), pyvalue(sums[code]),
+                        pyvalue(squares[code]), pyvalue(mins[code]),
+                        pyvalue(maxs[code]))
+    else:
+        ufunc = {'sum': numpy.add, 'min': numpy.minimum,
+                 'max': numpy.maximum}[aggregate]
+        results = ufunc.reduceat(values, starts, axis=0)
+        for (code, key) in enumerate(groupkeys):
+            yield key, pyvalue(results[code])
+
+
+class AggregatingMapper(object):
+    """
+    Aggregates the numeric values a mapper outputs per key, a block of
+    records at a time, for aggregatecombiner and aggregatereducer. The
+    -blocksize option overrides the default number of records per block.
+    """
+
+    def __init__(self, mapper, aggregate='sum', blocksize=AGGREGATE_BLOCKSIZE):
+        if aggregate not in AGGREGATES:
+            raise ValueError('unknown aggregate: %s' % aggregate)
+        self.mapper = mapper
+        (self.aggregate, self.blocksize) = (aggregate, blocksize)
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, aggregate) = (self.mapper, self.aggregate)
+        blocksize = int(os.environ.get('dumbo_blocksize', self.blocksize))
+        (keys, values) = ([], [])
+        for key, value in data:
+            for k, v in mapper(key, value):
+                keys.append(k)
+                values.append(v)
+            if len(keys) >= blocksize:
+                for output in aggregateblock(keys, values, aggregate):
+                    yield output
+                (keys, values) = ([], [])
+        for output in aggregateblock(keys, values, aggregate):
+            yield output
+
+
+def mergepartials(values, aggregate):
+    if aggregate == 'stats':
+        partials = list(values)
+        n = sum(partial[0] for partial in partials)
+        columns = [numpy.asarray([partial[i] for partial in partials])
+                   for i in xrange(1, 5)]
+        return (n, columns[0].sum(axis=0), columns[1].sum(axis=0),
+                columns[2].min(axis=0), columns[3].max(axis=0))
+    values = numpy.asarray(list(values))
+    return getattr(values, aggregate)(axis=0)
+
+
+def aggregatecombiner(aggregate='sum'):
+    """Returns a combiner that merges the partial aggregates for each key"""
+    def combiner(key, values):
+        merged = mergepartials(values, aggregate)
+        if aggregate == 'stats':
+            yield key, (merged[0], ) + tuple(map(pyvalue, merged[1:]))
+        else:
+            yield key, pyvalue(merged)
+    combiner.associative = True
+    return combiner
+
+
+def aggregatereducer(aggregate='sum'):
+    """
+    Returns a reducer that merges the partial aggregates for each key. For
+    'stats' it outputs (n, mean, std, min, max) like statsreducer, where
+    all but n are tuples for vector values.
+    """
+    def reducer(key, values):
+        merged = mergepartials(values, aggregate)
+        if aggregate != 'stats':
+            yield key, pyvalue(merged)
+            return
+        (n, s1, s2, minimum, maximum) = merged
+        mean = s1 / float(n)
+        std = numpy.zeros_like(mean)
+        if n > 1:  # sample standard deviation
+            std = numpy.sqrt(numpy.maximum((s2 - s1 * mean) / (n - 1), 0))
+        yield key, (n, pyvalue(mean), pyvalue(std), pyvalue(minimum),
+                    pyvalue(maximum))
+    return reducer
@@ -0,0 +1,163 @@
+"""
+Bloom filters for semi-joins: a filter built over the primary keys lets the
+secondary mappers drop most records that would not join anyway, before they
+get shuffled.
+"""
+
+import os
+import math
+import types
+import base64
+import struct
+from hashlib import md5
+from struct import Struct
+
+from dumbo.util import loadclassname, loadcode, expandpaths, Options
+
+BLOOMFILTER_ERRORRATE = 0.01
+
+_header = Struct('<4sQL')
+_hashes = Struct('<QQ')
+_MAGIC = 'DBF1'
+
+
+def bloomsize(capacity, errorrate=BLOOMFILTER_ERRORRATE):
+    """Returns the optimal number of bits and hash functions"""
+    capacity = max(capacity, 1)
+    nbits = int(math.ceil(-capacity * math.log(errorrate) / math.log(2) ** 2))
+    nbits = (nbits + 7) // 8 * 8
+    nhashes = max(int(round(float(nbits) / capacity * math.log(2))), 1)
+    return (nbits, nhashes)
+
+
+class BloomFilter(object):
+    """
+    Set membership test with false positives but no false negatives. Keys
+    that are not strings are hashed by their repr, so the filter gives the
+    same answers in every process.
+    """
+
+    def __init__(self, capacity=None, errorrate=BLOOMFILTER_ERRORRATE,
+                 nbits=None, nhashes=None, bits=None):
+        if nbits is None:
+            (nbits, nhashes) = bloomsize(capacity, errorrate)
+        (self.nbits, self.nhashes) = (nbits, nhashes)
+        self.bits = bits if bits is not None else bytearray(nbits // 8)
+
+    def positions(self, key):
+        if type(key) is not str:
+            key = repr(key)
+        (h1, h2) = _hashes.unpack(md5(key).digest())
+        (nbits, h2) = (self.nbits, h2 | 1)
+        return [(h1 + i * h2) % nbits for i in xrange(self.nhashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self.positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self.positions(key):
+            if not bits[pos >> 3] & 1 << (pos & 7):
+                return False
+        return True
+
+    def update(self, other):
+        """Adds all keys of another filter with the same dimensions"""
+        if (other.nbits, other.nhashes) != (self.nbits, self.nhashes):
+            raise ValueError('cannot combine bloom filters of different sizes')
+        bits = self.bits
+        for (i, byte) in enumerate(other.bits):
+            if byte:
+                bits[i] |= byte
+
+    def tostring(self):
+        return _header.pack(_MAGIC, self.nbits, self.nhashes) + str(self.bits)
+
+    @classmethod
+    def fromstring(cls, data):
+        (magic, nbits, nhashes) = _header.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError('not a bloom filter')
+        return cls(nbits=nbits, nhashes=nhashes,
+                   bits=bytearray(data[_header.size:]))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the union of the filters in the given output file(s), as
+        written by BloomFilterReducer in either text or code format
+        """
+        codec = os.environ.get('dumbo_codec')
+        bloomfilter = None
+        for filepath in expandpaths([path]):
+            lines = (line[:-1] for line in open(filepath) if line.strip())
+            for line in lines:
+                value = line.split('\t', 1)[-1]
+                try:
+                    other = cls.fromstring(base64.b64decode(value))
+                except (ValueError, TypeError, struct.error):  # code format
+                    value = list(loadcode([line], codec))[0][1]
+                    other = cls.fromstring(base64.b64decode(value))
+                if bloomfilter is None:
+                    bloomfilter = other
+                else:
+                    bloomfilter.update(other)
+        if bloomfilter is None:
+            raise ValueError('no bloom filter found in %s' % path)
+        return bloomfilter
+
+
+class BloomFilterMapper(object):
+    """
+    Builds a bloom filter over the keys the given mapper outputs, and
+    outputs it as a single base64 encoded value at the end of the task
+    """
+
+    def __init__(self, mapper, capacity, errorrate=BLOOMFILTER_ERRORRATE):
+        self.mapper = mapper
+        (self.capacity, self.errorrate) = (capacity, errorrate)
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        bloomfilter = BloomFilter(self.capacity, self.errorrate)
+        add = bloomfilter.add
+        for key, value in data:
+            for k, v in self.mapper(key, value):
+                add(k)
+        yield 'bloomfilter', base64.b64encode(bloomfilter.tostring())
+
+
+def bloomfilterreducer(key, values):
+    """Combines the filters from all map tasks into a single one"""
+    bloomfilter = None
+    for value in values:
+        other = BloomFilter.fromstring(base64.b64decode(value))
+        if bloomfilter is None:
+            bloomfilter = other
+        else:
+            bloomfilter.update(other)
+    yield key, base64.b64encode(bloomfilter.tostring())
+bloomfilterreducer.associative = True
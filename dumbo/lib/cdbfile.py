@@ -0,0 +1,83 @@
+"""
+Pure Python reader for constant dbs, such as the ones CDBReducer generates.
+The file gets memory mapped, so it is shared by all processes on a machine
+and only the pages that are actually used need to be read.
+
+For more info on constant dbs see http://cr.yp.to/cdb.html
+"""
+
+import os
+import mmap
+from struct import Struct
+
+_pair = Struct('<LL')
+
+
+def cdbhash(key):
+    h = 5381
+    for c in key:
+        h = ((h << 5) + h ^ ord(c)) & 0xffffffff
+    return h
+
+
+class CDBFile(object):
+
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.size = os.fstat(fd).st_size
+            if self.size < 2048:
+                raise ValueError('not a constant db: %s' % path)
+            self.map = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        unpack = _pair.unpack_from
+        self.tables = [unpack(self.map, i * 8) for i in xrange(256)]
+
+    def getall(self, key):
+        """Yields all values for the given key, in insertion order"""
+        (map, unpack) = (self.map, _pair.unpack_from)
+        h = cdbhash(key)
+        (tablepos, slots) = self.tables[h & 255]
+        if not slots:
+            return
+        slot = (h >> 8) % slots
+        for _ in xrange(slots):
+            (slothash, recordpos) = unpack(map, tablepos + slot * 8)
+            if not recordpos:
+                return
+            if slothash == h:
+                (klen, vlen) = unpack(map, recordpos)
+                start = recordpos + 8
+                if klen == len(key) and map[start:start + klen] == key:
+                    yield map[start + klen:start + klen + vlen]
+            slot += 1
+            if slot == slots:
+                slot = 0
+
+    def get(self, key, default=None):
+        for value in self.getall(key):
+            return value
+        return default
+
+    def __getitem__(self, key):
+        for value in self.getall(key):
+            return value
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        for value in self.getall(key):
+            return True
+        return False
+
+    def iteritems(self):
+        (map, unpack) = (self.map, _pair.unpack_from)
+        (pos, end) = (2048, min(pos for (pos, _) in self.tables))
+        while pos < end:
+            (klen, vlen) = unpack(map, pos)
+            pos += 8
+            yield (map[pos:pos + klen], map[pos + klen:pos + klen + vlen])
+            pos += klen + vlen
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,465 @@
+"""
+Mergeable sketches that summarize many values in a fixed amount of memory,
+so that combiners can shrink them before the shuffle. Sketches get passed
+on as compact strings, which work for both typed bytes and code formats.
+"""
+
+import os
+import math
+import types
+import zlib
+import heapq
+import random
+from array import array
+from hashlib import md5
+from struct import Struct
+
+from dumbo.util import loadclassname, Options
+
+HLL_PRECISION = 12  # 4096 registers, about 1.6% standard error
+KLL_K = 200  # about 1.7% rank error
+QUANTILES = (0.5, 0.9, 0.99)
+TOPK_CAPACITY = 1000
+
+_hash64 = Struct('<Q')
+_kllheader = Struct('<HH')
+_klllevel = Struct('<L')
+
+
+def hash64(item):
+    if type(item) is not str:
+        item = repr(item)
+    return _hash64.unpack_from(md5(item).digest())[0]
+
+
+class HyperLogLog(object):
+    """Estimates the number of distinct items it has seen"""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision should be between 4 and 16')
+        self.precision = precision
+        if registers is None:
+            registers = bytearray(1 << precision)
+        self.registers = registers
+
+    def add(self, item):
+        h = hash64(item)
+        bits = 64 - self.precision
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        index = h >> bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other):
+        """Merges in another sketch with the same precision"""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches of different precisions')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        registers = self.registers
+        m = len(registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in registers)
+        zeros = registers.count('\0')
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)  # linear counting
+        return estimate
+
+    def tostring(self):
+        return chr(self.precision) + zlib.compress(str(self.registers), 1)
+
+    @classmethod
+    def fromstring(cls, data):
+        return cls(ord(data[0]), bytearray(zlib.decompress(data[1:])))
+
+
+class KLLSketch(object):
+    """
+    Estimates quantiles of a stream of numbers. Level h holds items that
+    each stand for 2**h original ones, and a full level gets compacted by
+    sorting it and promoting every other item to the next level. Larger k
+    values give more accurate estimates but bigger sketches.
+    """
+
+    def __init__(self, k=KLL_K, levels=None):
+        self.k = k
+        self.levels = levels or [[]]
+        self.size = sum(len(level) for level in self.levels)
+        self.setmaxsize()
+
+    def setmaxsize(self):
+        self.capacities = [self.capacity(h) for h in xrange(len(self.levels))]
+        self.maxsize = sum(self.capacities)
+
+    def capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * (2.0 / 3) ** depth)), 2)
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.size += 1
+        if self.size >= self.maxsize:
+            self.compress()
+
+    def update(self, other):
+        """Merges in another sketch"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for (level, items) in zip(self.levels, other.levels):
+            level.extend(items)
+        self.size += other.size
+        self.setmaxsize()
+        while self.size >= self.maxsize:
+            self.compress()
+
+    def compress(self):
+        levels = self.levels
+        for h in xrange(len(levels)):
+            if len(levels[h]) >= self.capacities[h]:
+                if h + 1 == len(levels):
+                    levels.append([])
+                    self.setmaxsize()
+                items = sorted(levels[h])
+                levels[h] = [items.pop()] if len(items) % 2 else []
+                levels[h + 1].extend(items[random.randint(0, 1)::2])
+                self.size -= len(items) // 2
+                if self.size < self.maxsize:
+                    break
+
+    def count(self):
+        return sum(len(level) << h for (h, level) in enumerate(self.levels))
+
+    def quantiles(self, fractions=QUANTILES):
+        """Returns the estimated values at the given fractions of the stream"""
+        weighted = []
+        for (h, level) in enumerate(self.levels):
+            weighted.extend((value, 1 << h) for value in level)
+        if not weighted:
+            return [None] * len(fractions)
+        weighted.sort()
+        (n, results) = (self.count(), [])
+        for fraction in fractions:
+            (target, seen) = (fraction * n, 0)
+            for (value, weight) in weighted:
+                seen += weight
+                if seen >= target:
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, fraction):
+        return self.quantiles((fraction, ))[0]
+
+    def tostring(self):
+        parts = [_kllheader.pack(self.k, len(self.levels))]
+        for level in self.levels:
+            parts.append(_klllevel.pack(len(level)))
+            parts.append(array('d', level).tostring())
+        return ''.join(parts)
+
+    @classmethod
+    def fromstring(cls, data):
+        (k, nlevels) = _kllheader.unpack_from(data)
+        (pos, levels) = (_kllheader.size, [])
+        for _ in xrange(nlevels):
+            (length, ) = _klllevel.unpack_from(data, pos)
+            pos += _klllevel.size
+            level = array('d')
+            level.fromstring(data[pos:pos + 8 * length])
+            levels.append(level.tolist())
+            pos += 8 * length
+        return cls(k, levels)
+
+
+class SpaceSaving(object):
+    """
+    Keeps approximate counts for the (at most) capacity most frequent items
+    it has seen. When a new item comes in while the sketch is full, it
+    replaces the item with the smallest count and inherits that count as
+    its error, so every count is an upper bound and count - error a lower
+    bound for the true frequency.
+    """
+
+    def __init__(self, capacity=TOPK_CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = counters or {}
+        self.heap = None  # gets built once the sketch is full
+
+    def add(self, item, count=1):
+        counters = self.counters
+        counter = counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(counters) < self.capacity:
+            counters[item] = [count, 0]
+        else:
+            minimum = self.popmin()
+            counters[item] = [minimum + count, minimum]
+            heapq.heappush(self.heap, (minimum + count, item))
+
+    def popmin(self):
+        (counters, heap) = (self.counters, self.heap)
+        if heap is None:
+            heap = self.heap = [(c[0], i) for (i, c) in counters.iteritems()]
+            heapq.heapify(heap)
+        while True:
+            (count, item) = heapq.heappop(heap)
+            current = counters[item][0]
+            if current == count:
+                del counters[item]
+                return count
+            heapq.heappush(heap, (current, item))  # stale entry
+
+    def minimum(self):
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(c[0] for c in self.counters.itervalues())
+
+    def update(self, other):
+        """Merges in another sketch, keeping the bounds valid"""
+        (mine, theirs) = (self.minimum(), other.minimum())
+        counters = self.counters
+        for counter in counters.itervalues():
+            counter[0] += theirs
+            counter[1] += theirs
+        for (item, (count, error)) in other.counters.iteritems():
+            counter = counters.get(item)
+            if counter is None:
+                counters[item] = [count + mine, error + mine]
+            else:
+                counter[0] += count - theirs
+                counter[1] += error - theirs
+        if len(counters) > self.capacity:
+            largest = heapq.nlargest(self.capacity, counters.iteritems(),
+                                     key=lambda (i, c): c[0])
+            self.counters = dict(largest)
+        self.heap = None
+
+    def topk(self, k):
+        """Returns (item, count, error) triples for the k largest counts"""
+        largest = heapq.nlargest(k, self.counters.iteritems(),
+                                 key=lambda (i, c): c[0])
+        return [(item, count, error) for (item, (count, error)) in largest]
+
+    def dump(self):
+        return (self.capacity, self.topk(self.capacity))
+
+    @classmethod
+    def fromdump(cls, data):
+        (capacity, triples) = data
+        counters = dict((t[0], [t[1], t[2]]) for t in triples)
+        return cls(capacity, counters)
+
+
+def mergesketches(cls, values):
+    sketch = None
+    for value in values:
+        other = cls.fromstring(value)
+        if sketch is None:
+            sketch = other
+        else:
+            sketch.update(other)
+    return sketch
+
+
+class HLLMapper(object):
+    """
+    Feeds the outputs of a mapper into a HyperLogLog sketch per key, and
+    outputs (key, sketch) pairs for hllcombiner and hllreducer. At most
+    maxkeys sketches are kept in memory at once.
+    """
+
+    def __init__(self, mapper, precision=HLL_PRECISION, maxkeys=1000):
+        self.mapper = mapper
+        (self.precision, self.maxkeys) = (precision, maxkeys)
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, sketches) = (self.mapper, {})
+        for key, value in data:
+            for k, v in mapper(key, value):
+                sketch = sketches.get(k)
+                if sketch is None:
+                    if len(sketches) >= self.maxkeys:
+                        for output in self.flush(sketches):
+                            yield output
+                    sketch = sketches[k] = HyperLogLog(self.precision)
+                sketch.add(v)
+        for output in self.flush(sketches):
+            yield output
+
+    def flush(self, sketches):
+        for key, sketch in sketches.iteritems():
+            yield key, sketch.tostring()
+        sketches.clear()
+
+
+def hllcombiner(key, values):
+    yield key, mergesketches(HyperLogLog, values).tostring()
+hllcombiner.associative = True
+
+
+def hllreducer(key, values):
+    yield key, int(round(mergesketches(HyperLogLog, values).count()))
+
+
+def addvalues(sketch, values):
+    """Adds plain numbers and merges serialized sketches"""
+    for value in values:
+        if type(value) is str:
+            sketch.update(KLLSketch.fromstring(value))
+        else:
+            sketch.add(value)
+    return sketch
+
+
+def quantilecombiner(k=KLL_K):
+    """
+    Returns a combiner that turns the numbers for each key into a KLL
+    sketch, merging them with the sketches earlier combiner runs output
+    """
+    def combiner(key, values):
+        yield key, addvalues(KLLSketch(k), values).tostring()
+    combiner.associative = True
+    return combiner
+
+
+def quantilereducer(fractions=QUANTILES, k=KLL_K):
+    """
+    Returns a reducer that outputs the number of values and the estimated
+    quantiles for each key, from numbers or quantilecombiner sketches
+    """
+    def reducer(key, values):
+        sketch = addvalues(KLLSketch(k), values)
+        yield key, tuple([sketch.count()] + sketch.quantiles(fractions))
+    return reducer
+
+
+class TopKMapper(object):
+    """
+    Counts the values each output key of a mapper gets in a SpaceSaving
+    sketch, for topkcombiner and topkreducer. When keys is true, the
+    output keys themselves get counted instead, all in one sketch (which
+    is what skewedkeyreducer expects).
+    """
+
+    def __init__(self, mapper, capacity=TOPK_CAPACITY, maxkeys=1000,
+                 keys=False):
+        self.mapper = mapper
+        (self.capacity, self.maxkeys) = (capacity, maxkeys)
+        self.keys = keys
+        self.opts = Options()
+        if hasattr(mapper, 'opts'):
+            self.opts += mapper.opts
+        self.closefunc = None
+
+    def configure(self):
+        mrbase_class = loadclassname(os.environ['dumbo_mrbase_class'])
+        mapper = self.mapper
+        if type(mapper) in (types.ClassType, type):
+            mappercls = type('DumboMapper', (mapper, mrbase_class), {})
+            mapper = mappercls()
+        if hasattr(mapper, 'configure'):
+            mapper.configure()
+        if hasattr(mapper, 'close'):
+            self.closefunc = mapper.close
+        if hasattr(mapper, 'map'):
+            mapper = mapper.map
+        self.mapper = mapper
+
+    def close(self):
+        if self.closefunc:
+            self.closefunc()
+
+    def __call__(self, data):
+        (mapper, sketches) = (self.mapper, {})
+        if self.keys:
+            sketch = sketches['keys'] = SpaceSaving(self.capacity)
+            for key, value in data:
+                for k, v in mapper(key, value):
+                    sketch.add(k)
+        else:
+            for key, value in data:
+                for k, v in mapper(key, value):
+                    sketch = sketches.get(k)
+                    if sketch is None:
+                        if len(sketches) >= self.maxkeys:
+                            for output in self.flush(sketches):
+                                yield output
+                        sketch = sketches[k] = SpaceSaving(self.capacity)
+                    sketch.add(v)
+        for output in self.flush(sketches):
+            yield output
+
+    def flush(self, sketches):
+        for key, sketch in sketches.iteritems():
+            yield key, sketch.dump()
+        sketches.clear()
+
+
+def mergespacesavings(values):
+    sketch = None
+    for value in values:
+        other = SpaceSaving.fromdump(value)
+        if sketch is None:
+            sketch = other
+        elif other.capacity > sketch.capacity:
+            other.update(sketch)
+            sketch = other
+        else:
+            sketch.update(other)
+    return sketch
+
+
+def topkcombiner(key, values):
+    yield key, mergespacesavings(values).dump()
+topkcombiner.associative = True
+
+
+def topkreducer(k):
+    """
+    Returns a reducer that outputs the k most frequent items for each key
+    as (item, count, error) triples, where the true count lies between
+    count - error and count
+    """
+    def reducer(key, values):
+        yield key, mergespacesavings(values).topk(k)
+    return reducer
+
+
+def skewedkeyreducer(threshold):
+    """
+    Returns a reducer that outputs the keys counted by a TopKMapper with
+    keys=True that certainly occur at least threshold times, together with
+    their lower bounds. The output can be loaded with loadhotkeys for
+    salting joins.
+    """
+    def reducer(key, values):
+        sketch = mergespacesavings(values)
+        for (item, count, error) in sketch.topk(sketch.capacity):
+            if count - error >= threshold:
+                yield item, count - error
+    return reducer
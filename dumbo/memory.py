@@ -0,0 +1,135 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keeps track of the memory a task uses by sampling its resident set size,
+so that buffers can spill before the task runs out of memory.
+"""
+
+import sys
+import atexit
+import resource
+
+from dumbo.util import incrcounter
+
+MEMORY_CHECKINTERVAL = 1000  # calls to pressure() between samples
+MEMORY_SOFTFRACTION = 0.7  # default soft limit, as a fraction of the hard one
+MEMORY_MARGIN = 0.05  # growth that counts as new pressure after a spill
+
+_pagesize = resource.getpagesize()
+
+
+def privaterss():
+    """
+    Returns the resident memory of this process that is not backed by
+    files, or None when it cannot be determined. Memory mapped files do
+    not count since the kernel can always drop their pages.
+    """
+    try:
+        statm = open('/proc/self/statm')
+        try:
+            fields = statm.read().split()
+        finally:
+            statm.close()
+    except IOError:
+        return None
+    return (int(fields[1]) - int(fields[2])) * _pagesize
+
+
+class MemoryManager(object):
+    """
+    Tells buffers when to spill, based on the sampled resident memory and
+    a soft limit. Exceeding the hard limit raises a MemoryError.
+    """
+
+    def __init__(self, softlimit, hardlimit=None,
+                 checkinterval=MEMORY_CHECKINTERVAL):
+        (self.softlimit, self.hardlimit) = (softlimit, hardlimit)
+        self.checkinterval = checkinterval
+        self.margin = int(softlimit * MEMORY_MARGIN)
+        self.calls = 0
+        self.spills = 0
+        self.rss = privaterss()
+        self.available = self.rss is not None
+        (self.peak, self.baseline) = (self.rss or 0, 0)
+
+    def sample(self):
+        rss = privaterss()
+        if rss is None:
+            return 0
+        self.rss = rss
+        self.peak = max(self.peak, rss)
+        self.baseline = min(self.baseline, rss)
+        if self.hardlimit and rss > self.hardlimit:
+            raise MemoryError('resident memory (%i bytes) exceeds the hard '
+                              'limit (%i bytes)' % (rss, self.hardlimit))
+        return rss
+
+    def overlimit(self):
+        """
+        Returns True when the resident memory exceeds the soft limit, and
+        grew noticeably since the last spill. The latter avoids spilling
+        over and over again when freed memory does not get returned to
+        the operating system.
+        """
+        return self.sample() > max(self.softlimit,
+                                   self.baseline + self.margin)
+
+    def pressure(self):
+        """Cheaper version of overlimit() that only samples now and then"""
+        self.calls += 1
+        if self.calls < self.checkinterval:
+            return False
+        self.calls = 0
+        return self.overlimit()
+
+    def watch(self, records):
+        """
+        Yields the given records while sampling now and then, so that the
+        hard limit also holds when no buffer asks for pressure()
+        """
+        pressure = self.pressure
+        for record in records:
+            pressure()
+            yield record
+
+    def released(self):
+        """To be called after spilling a buffer"""
+        self.spills += 1
+        self.baseline = self.sample()
+
+    def report(self):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        incrcounter('Dumbo', 'Peak RSS MB', maxrss / 1024)  # in KB on Linux
+        incrcounter('Dumbo', 'Peak private RSS MB', self.peak / 1048576)
+        if self.spills:
+            incrcounter('Dumbo', 'Memory spills', self.spills)
+
+
+def getmanager(hardlimit, softlimit=None):
+    """
+    Returns a manager for the given limits that reports its counters at
+    exit, or None when the resident memory cannot be determined.
+    """
+    if not softlimit:
+        softlimit = int(hardlimit * MEMORY_SOFTFRACTION)
+    manager = MemoryManager(softlimit, hardlimit)
+    if not manager.available:
+        return None
+    print >> sys.stderr, 'INFO: memory limits = %i (soft), %i (hard)' % \
+                         (softlimit, hardlimit)
+    atexit.register(manager.report)
+    return manager
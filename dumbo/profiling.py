@@ -0,0 +1,309 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-task profiling, enabled by the -profile cpu|alloc option. Every task
+writes a _profile-<task>.<kind> file to the profile directory, and
+"dumbo profile <dir>" merges these files into a single report. Allocation
+profiling relies on tracemalloc, so jobs that cannot import it fail right
+away instead of silently producing no profiles.
+
+The lighter -timing yes option reports the time spent in each phase of
+a task as counters instead.
+"""
+
+import sys
+import os
+import time
+import types
+import signal
+import atexit
+import tempfile
+from itertools import count, izip, imap
+from operator import itemgetter
+
+from dumbo.util import incrcounter, savefile
+
+ALLOC_FRAMES = 10
+TIMING_INTERVAL = 0.01  # seconds
+TIMING_GROUP = 'Dumbo Timing'
+
+_cpuclock = getattr(time, 'process_time', time.clock)
+
+
+class CPUProfiler(object):
+    kind = 'cpu'
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def clear(self):
+        self.profile.clear()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+
+
+class AllocProfiler(object):
+    kind = 'alloc'
+
+    def __init__(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            raise ImportError('-profile alloc needs the tracemalloc module, '
+                              'which %s does not provide' % sys.executable)
+        self.tracemalloc = tracemalloc
+
+    def start(self):
+        self.tracemalloc.start(ALLOC_FRAMES)
+
+    def clear(self):
+        self.tracemalloc.clear_traces()
+
+    def stop(self, path):
+        snapshot = self.tracemalloc.take_snapshot()
+        peak = self.tracemalloc.get_traced_memory()[1]
+        self.tracemalloc.stop()
+        print >> sys.stderr, 'INFO: peak traced memory =', peak
+        snapshot.dump(path)
+
+
+profilers = {'cpu': CPUProfiler, 'alloc': AllocProfiler}
+
+
+def getprofiler(kind):
+    if kind not in profilers:
+        print >> sys.stderr, 'WARNING: unknown profile kind:', kind
+        return None
+    try:
+        return profilers[kind]()
+    except ImportError, e:
+        print >> sys.stderr, 'WARNING: cannot profile %s (%s)' % (kind, e)
+        return None
+
+
+def checkprofile(kind):
+    """Returns why tasks cannot profile the given kind, or None if they can"""
+    if kind not in profilers:
+        return 'unknown profile kind: %s' % kind
+    try:
+        profilers[kind]()
+    except ImportError, e:
+        return str(e)
+    return None
+
+
+_task = {}
+
+
+def starttask(kind, profiledir, taskname):
+    """Profiles the rest of this task process, until it exits"""
+    profiler = getprofiler(kind)
+    if not profiler:
+        return
+    _task.update(profiler=profiler, dir=profiledir, name=taskname)
+    atexit.register(finishtask)
+    profiler.start()
+
+
+def forkedtask():
+    """Makes a forked worker profile itself separately from its parent"""
+    if _task:
+        _task['profiler'].clear()
+        _task['name'] += '-%i' % os.getpid()
+
+
+def finishtask():
+    if not _task:
+        return
+    (profiler, profiledir, name) = (_task['profiler'], _task['dir'],
+                                    _task['name'])
+    _task.clear()
+    filename = '_profile-%s.%s' % (name, profiler.kind)
+    (fd, path) = tempfile.mkstemp(suffix='.' + profiler.kind)
+    os.close(fd)
+    try:
+        profiler.stop(path)
+        savefile(path, profiledir, filename)
+        print >> sys.stderr, 'INFO: wrote %s profile to %s/%s' % \
+                             (profiler.kind, profiledir, filename)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def findprofiles(dirpath):
+    profiles = {}
+    for name in sorted(os.listdir(dirpath)):
+        if name.startswith('_profile-'):
+            kind = name.split('.')[-1]
+            profiles.setdefault(kind, []).append(os.path.join(dirpath, name))
+    return profiles
+
+
+def report(dirpath, sort='cumulative', limit=40, out=sys.stdout):
+    """Prints a report that merges all task profiles in the directory"""
+    profiles = findprofiles(dirpath)
+    if not profiles:
+        print >> sys.stderr, 'ERROR: no profiles found in', dirpath
+        return 1
+    if 'cpu' in profiles:
+        import pstats
+        paths = profiles['cpu']
+        print >> out, 'CPU profile merged from %i tasks' % len(paths)
+        stats = pstats.Stats(paths[0], stream=out)
+        for path in paths[1:]:
+            stats.add(path)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    if 'alloc' in profiles:
+        import tracemalloc
+        paths = profiles['alloc']
+        print >> out, 'Allocation profile merged from %i tasks' % len(paths)
+        totals = {}
+        for path in paths:
+            snapshot = tracemalloc.Snapshot.load(path)
+            for stat in snapshot.statistics('lineno'):
+                location = str(stat.traceback[0])
+                total = totals.setdefault(location, [0, 0])
+                total[0] += stat.size
+                total[1] += stat.count
+        ranked = sorted(totals.iteritems(), key=lambda t: t[1][0],
+                        reverse=True)
+        for (location, (size, blocks)) in ranked[:limit]:
+            print >> out, '%12i B %10i blocks  %s' % (size, blocks, location)
+    return 0
+
+
+def _codes(obj):
+    """Finds the code objects that implement the given object"""
+    if type(obj) is types.CodeType:
+        yield obj
+    elif type(obj) is types.GeneratorType:
+        yield obj.gi_code
+    elif type(obj) is types.FunctionType:
+        stack = [obj.func_code]
+        while stack:
+            code = stack.pop()
+            yield code  # including nested functions and generator expressions
+            stack.extend(c for c in code.co_consts
+                         if type(c) is types.CodeType)
+    elif type(obj) is types.MethodType:
+        for code in _codes(obj.im_func):
+            yield code
+    elif type(obj) in (types.ClassType, type):
+        for value in vars(obj).values():
+            if type(value) in (staticmethod, classmethod):
+                value = value.__func__
+            if type(value) is types.FunctionType:
+                for code in _codes(value):
+                    yield code
+    elif hasattr(obj, '__call__'):  # an instance of a callable class
+        for code in _codes(type(obj)):
+            yield code
+
+
+class PhaseTimer(object):
+    """
+    Measures the wall and CPU time spent in the phases of a task by looking
+    at the stack on a timer signal, which charges the time since the
+    previous signal to the innermost frame that belongs to a phase. This
+    keeps the records free of any per-record timing overhead.
+    """
+
+    def __init__(self, interval=TIMING_INTERVAL):
+        self.interval = interval
+        self.phases = {}  # code object -> phase
+        (self.wall, self.cpu) = ({}, {})
+        self.counters = []  # (name, count object)
+        self.bytes = {}
+        self.add('Reading input', self.readlines)
+        self.add('Writing output', self.writelines)
+
+    def add(self, phase, *objs):
+        """Assigns the code of the given functions, classes etc. to phase"""
+        for obj in objs:
+            if obj is not None:
+                for code in _codes(obj):
+                    self.phases.setdefault(code, phase)
+
+    def count(self, name, data):
+        """Counts the records that pass, without Python level overhead"""
+        counter = count()
+        self.counters.append((name, counter))
+        return imap(itemgetter(0), izip(data, counter))
+
+    def readlines(self, file, name='Input'):
+        nbytes = 0
+        try:
+            for line in file:
+                nbytes += len(line)
+                yield line[:-1]
+        finally:
+            self.bytes[name + ' bytes'] = nbytes
+
+    def writelines(self, lines, file, name='Output'):
+        (nbytes, nrecords, write) = (0, 0, file.write)
+        for line in lines:
+            write(line)
+            write('\n')
+            nbytes += len(line) + 1
+            nrecords += 1
+        self.bytes[name + ' bytes'] = nbytes
+        self.bytes[name + ' records'] = nrecords
+
+    def sample(self, signum, frame):
+        (wall, cpu) = (time.time(), _cpuclock())
+        phase = 'Other'
+        while frame is not None:
+            if frame.f_code in self.phases:
+                phase = self.phases[frame.f_code]
+                break
+            frame = frame.f_back
+        self.wall[phase] = self.wall.get(phase, 0.0) + wall - self.last[0]
+        self.cpu[phase] = self.cpu.get(phase, 0.0) + cpu - self.last[1]
+        self.last = (wall, cpu)
+
+    def start(self):
+        self.last = self.first = (time.time(), _cpuclock())
+        self.handler = signal.signal(signal.SIGALRM, self.sample)
+        signal.siginterrupt(signal.SIGALRM, False)  # restart system calls
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.handler)
+        self.sample(None, sys._getframe(1))
+
+    def report(self):
+        for phase in self.wall:
+            incrcounter(TIMING_GROUP, phase + ' wall ms',
+                        int(self.wall[phase] * 1000))
+            incrcounter(TIMING_GROUP, phase + ' CPU ms',
+                        int(self.cpu[phase] * 1000))
+        incrcounter(TIMING_GROUP, 'Task wall ms',
+                    int((self.last[0] - self.first[0]) * 1000))
+        incrcounter(TIMING_GROUP, 'Task CPU ms',
+                    int((self.last[1] - self.first[1]) * 1000))
+        for (name, counter) in self.counters:
+            incrcounter(TIMING_GROUP, name, int(repr(counter)[6:-1]))
+        for (name, value) in self.bytes.iteritems():
+            incrcounter(TIMING_GROUP, name, value)
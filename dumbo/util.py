@@ -16,48 +16,447 @@
 
 import sys
 import os
+import time
+import atexit
 import re
+import glob
+import shutil
 import subprocess
 import warnings
+import tempfile
+import heapq
+import marshal
+import struct
+import cPickle
+from hashlib import md5
+from ast import literal_eval
+from binascii import a2b_base64, b2a_base64
 from collections import defaultdict
+from itertools import islice
 
-def sorted(iterable, piecesize=None, key=None, reverse=False):
-    if not piecesize:
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+TEXTINPUT_BUFSIZE = 1048576
+SPILL_BATCHSIZE = 1024
+COUNTER_FLUSHINTERVAL = 10.0  # seconds
+COUNTER_FLUSHSIZE = 1000  # distinct counters
+STATUS_INTERVAL = 1.0  # seconds
+SORT_MERGEFACTOR = 64
+SORT_CHUNKSIZE = 1024  # values read between memory checks
+
+
+class SpillFile(object):
+    """
+    Temporary file that holds a sequence of records in pickled batches.
+    It can be iterated over several times, also concurrently.
+    """
+
+    def __init__(self, records=(), dir=None):
+        self.file = tempfile.TemporaryFile(dir=dir)
+        (self.count, self.nbytes) = (0, 0)
+        self.extend(records)
+
+    def extend(self, records):
+        (file, batchsize) = (self.file, SPILL_BATCHSIZE)
+        file.seek(0, 2)
+        records = iter(records)
+        batch = list(islice(records, batchsize))
+        while batch:
+            cPickle.dump(batch, file, 2)
+            self.count += len(batch)
+            batch = list(islice(records, batchsize))
+        self.nbytes = file.tell()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        (file, pos, end) = (self.file, 0, self.nbytes)
+        while pos < end:
+            file.seek(pos)
+            batch = cPickle.load(file)
+            pos = file.tell()
+            for record in batch:
+                yield record
+
+    def close(self):
+        self.file.close()
+
+
+class _Reversed(object):
+    __slots__ = ('key', )
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def mergesorted(runs, key=None, reverse=False):
+    """Merges iterables that were sorted with the given key and reverse"""
+    if key is None and not reverse:
+        return heapq.merge(*runs)
+    if reverse:
+        keyfunc = (lambda x: _Reversed(key(x))) if key else _Reversed
+    else:
+        keyfunc = key
+    # the run and record indices keep it stable and avoid comparing records
+    def decorate(i, run):
+        for j, x in enumerate(run):
+            yield (keyfunc(x), i, j, x)
+    decorated = [decorate(i, run) for i, run in enumerate(runs)]
+    return (x[-1] for x in heapq.merge(*decorated))
+
+
+def sorted(iterable, piecesize=None, key=None, reverse=False, memory=None):
+    """
+    Sorts externally when piecesize or a memory manager is given, spilling
+    sorted runs to disk every piecesize values or whenever the manager
+    reports that the soft memory limit got exceeded.
+    """
+    if not (piecesize or memory):
         values = list(iterable)
         values.sort(key=key, reverse=reverse)
         for value in values:
             yield value
-    else:  # piecewise sorted
-        sequence = iter(iterable)
-        while True:
-            values = list(sequence.next() for i in xrange(piecesize))
-            values.sort(key=key, reverse=reverse)
-            for value in values:
-                yield value
-            if len(values) < piecesize:
-                break
+        return
+    (sequence, runs, chunksize) = (iter(iterable), [], SORT_CHUNKSIZE)
+    if piecesize:
+        chunksize = min(chunksize, piecesize)
+    while True:
+        (values, full) = ([], False)
+        while not full:
+            size = len(values)
+            values.extend(islice(sequence, chunksize))
+            if len(values) - size < chunksize:
+                break  # exhausted
+            full = bool(piecesize and len(values) >= piecesize or
+                        memory and memory.overlimit())
+        values.sort(key=key, reverse=reverse)
+        if not full:
+            break
+        runs.append(SpillFile(values))
+        incrcounter('Dumbo', 'Sort spills', 1)
+        incrcounter('Dumbo', 'Sort spilled bytes', runs[-1].nbytes)
+        del values
+        if memory:
+            memory.released()
+        if len(runs) >= SORT_MERGEFACTOR:  # merge to limit open files
+            merged = SpillFile(mergesorted(runs, key, reverse))
+            for run in runs:
+                run.close()
+            runs = [merged]
+    if not runs:
+        for value in values:
+            yield value
+        return
+    for value in mergesorted(runs + [values], key, reverse):
+        yield value
+    for run in runs:
+        run.close()
+
+_counters = {}
+_reporting = {'flushed': time.time(), 'status': None, 'statustime': 0.0}
+
 
 def incrcounter(group, counter, amount):
-    print >> sys.stderr, 'reporter:counter:%s,%s,%s' % (group, counter, amount)
+    """Adds amount to a counter, buffered until the next flushcounters()"""
+    key = (group, counter)
+    _counters[key] = _counters.get(key, 0) + amount
+    if len(_counters) >= COUNTER_FLUSHSIZE or \
+    time.time() - _reporting['flushed'] >= COUNTER_FLUSHINTERVAL:
+        flushcounters()
 
 
 def setstatus(message):
-    print >> sys.stderr, 'reporter:status:%s' % message
+    """Sets the status, at most once per STATUS_INTERVAL seconds"""
+    _reporting['status'] = message
+    if time.time() - _reporting['statustime'] >= STATUS_INTERVAL:
+        flushstatus()
+
+
+def flushstatus():
+    if _reporting['status'] is not None:
+        print >> sys.stderr, 'reporter:status:%s' % _reporting['status']
+        (_reporting['status'], _reporting['statustime']) = (None, time.time())
+
+
+def flushcounters():
+    """Reports the buffered counter increments and status"""
+    for ((group, counter), amount) in _counters.iteritems():
+        print >> sys.stderr, 'reporter:counter:%s,%s,%s' % (group, counter,
+                                                            amount)
+    _counters.clear()
+    _reporting['flushed'] = time.time()
+    flushstatus()
+
+atexit.register(flushcounters)
+
+
+_literaltokens = re.compile(r"""\s*(?:
+    ('(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | ([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?[lLjJ]?)
+  | ([][(){},:])
+  | (None|True|False|set\(|frozenset\(|[uU]'(?:[^'\\\n]|\\.)*'|[uU]"(?:[^"\\\n]|\\.)*")
+  | (.)
+)""", re.VERBOSE).findall
+
+_literalnames = {'None': None, 'True': True, 'False': False}
+_literalclosers = {'(': ')', '[': ']', '{': '}', 'set(': ')', 'frozenset(': ')'}
+
+
+def _parsenumber(token):
+    if token.isdigit() and token[0] != '0' or token == '0':
+        return int(token)
+    last = token[-1]
+    if last in 'lL':
+        return long(token[:-1], 0)
+    elif last in 'jJ':
+        return complex(token)
+    elif '.' in token or 'e' in token or 'E' in token:
+        return float(token)
+    elif token.lstrip('+-')[:1] == '0':
+        return int(token, 0)  # octal, just like eval would do
+    return int(token)
+
+
+def _parseflattuple(text):
+    """Parses tuples of (non-escaped) strings and ints, or returns None"""
+    items = []
+    for item in text[1:-1].split(', '):
+        first = item[:1]
+        if first == "'":
+            if item[-1] != "'" or item.count("'") != 2 or '\\' in item:
+                return None
+            items.append(item[1:-1])
+        elif item.isdigit():
+            if first == '0' and item != '0':
+                return None  # octal
+            items.append(int(item))
+        elif first == '-' and item[1:].isdigit() and item[1:2] != '0':
+            items.append(int(item))
+        else:
+            return None
+    return tuple(items)
+
+
+def _parseliteral(text):
+    stack = []
+    opener, items, comma, expect = None, [], False, True
+    for string, number, punct, other, bad in _literaltokens(text):
+        if string:
+            value = string[1:-1]
+            if '\\' in value:
+                value = value.decode('string_escape')
+        elif number:
+            value = _parsenumber(number)
+        elif punct:
+            if punct == ',':
+                if expect or opener is None or opener.endswith('set(') or \
+                        opener == '{' and len(items) % 2:
+                    raise ValueError(text)
+                expect = comma = True
+                continue
+            elif punct in _literalclosers:
+                if not expect:
+                    raise ValueError(text)
+                stack.append((opener, items, comma))
+                opener, items, comma = punct, [], False
+                continue
+            elif punct == ':':
+                if expect or opener != '{' or not len(items) % 2:
+                    raise ValueError(text)
+                expect = True
+                continue
+            value = _closeliteral(text, punct, opener, items, comma)
+            opener, items, comma = stack.pop()
+            expect = True
+        elif other:
+            if other in _literalnames:
+                value = _literalnames[other]
+            elif other in _literalclosers:
+                if not expect:
+                    raise ValueError(text)
+                stack.append((opener, items, comma))
+                opener, items, comma = other, [], False
+                continue
+            else:
+                value = other[2:-1].decode('unicode_escape')
+        else:
+            raise ValueError(text)
+        if not expect:
+            raise ValueError(text)
+        items.append(value)
+        expect = False
+    if opener is not None or len(items) != 1:
+        raise ValueError(text)
+    return items[0]
+
+
+def _closeliteral(text, closer, opener, items, comma):
+    if opener is None or closer != _literalclosers[opener]:
+        raise ValueError(text)
+    if opener == '(':
+        if len(items) == 1 and not comma:
+            return items[0]
+        return tuple(items)
+    elif opener == '[':
+        return items
+    elif opener == '{':
+        if len(items) % 2:
+            raise ValueError(text)
+        return dict(zip(items[::2], items[1::2]))
+    elif len(items) == 1:
+        return set(items[0]) if opener == 'set(' else frozenset(items[0])
+    raise ValueError(text)
+
+
+def loadliteral(text):
+    """
+    Safely evaluates the repr of a Python literal. Strings, ints and flat
+    tuples of these parse two to three times faster than with eval. Other
+    literals, such as floats and nested containers, go through a general
+    parser that is somewhat slower than eval and about as fast as
+    literal_eval.
+
+    >>> loadliteral("('key', [1, 2.5, None], {'a': u'b'})")
+    ('key', [1, 2.5, None], {'a': u'b'})
+    >>> loadliteral("__import__('os')")
+    Traceback (most recent call last):
+    ...
+    ValueError: malformed string
+    """
+    first = text[:1]
+    if first == "'":
+        if text[-1] == "'" and text.count("'") == 2 and not '\\' in text:
+            return text[1:-1]
+    elif first in '123456789':
+        try:
+            return int(text)
+        except ValueError:
+            pass
+    elif first == '(' and text[-1:] == ')':
+        items = _parseflattuple(text)
+        if items is not None:
+            return items
+    try:
+        return _parseliteral(text)
+    except (ValueError, KeyError, IndexError):
+        pass
+    # fall back to the slow path for anything the parser doesn't cover
+    return literal_eval(text.strip())
+
+
+class Codec(object):
+    """
+    Converts keys and values to and from strings that contain no tabs
+    or newlines, so that they can be used in the text-based "code" format.
+    """
+
+    def __init__(self, name, dumps, loads,
+                 errors=(ValueError, TypeError, SyntaxError)):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.errors = errors  # exceptions that indicate bad input
+
+
+def _dumpsbinary(dumps):
+    return lambda obj: b2a_base64(dumps(obj))[:-1]
+
 
+def _loadsbinary(loads):
+    return lambda text: loads(a2b_base64(text))
 
-def dumpcode(outputs):
+
+def _dumpsmarshal(obj):
+    # version 0 writes interned strings just like all others, so equal keys
+    # always get the same text, which the unix backend shuffles by
+    return marshal.dumps(obj, 0)
+
+
+def _dumpspickle(obj):
+    pickler = cPickle.Pickler(2)
+    pickler.fast = 1  # no memo, so shared objects get written like copies
+    pickler.dump(obj)
+    return pickler.getvalue()
+
+
+codecs = {}
+
+
+def registercodec(codec):
+    codecs[codec.name] = codec
+
+
+registercodec(Codec('literal', repr, loadliteral))
+registercodec(Codec('eval', repr, eval))  # unsafe, only use on trusted data
+registercodec(Codec('json', lambda obj: json.dumps(obj, separators=(',', ':')),
+                    json.loads))
+registercodec(Codec('marshal', _dumpsbinary(_dumpsmarshal),
+                    _loadsbinary(marshal.loads), (ValueError, TypeError, EOFError)))
+registercodec(Codec('pickle', _dumpsbinary(_dumpspickle),
+                    _loadsbinary(cPickle.loads),
+                    (ValueError, TypeError, EOFError, cPickle.UnpicklingError)))
+
+DEFAULT_CODEC = 'literal'
+
+
+def getcodec(name=None):
+    """Returns the codec with the given name or (dotted) class name"""
+    if isinstance(name, Codec):
+        return name
+    name = name or DEFAULT_CODEC
+    if name in codecs:
+        return codecs[name]
+    if '.' in name:
+        return loadclassname(name)()
+    raise ValueError('unknown codec "%s"' % name)
+
+
+def dumpcode(outputs, codec=None):
+    dumps = getcodec(codec).dumps
     for output in outputs:
-        yield map(repr, output)
+        yield map(dumps, output)
+
 
+_immutabletypes = (str, unicode, int, long, float, bool, tuple, frozenset,
+                   type(None))
 
-def loadcode(inputs):
+
+def loadcode(inputs, codec=None):
+    MAX_LOGGED_BADINPUTS = 500
+    badinputs = 0
+    codec = getcodec(codec)
+    loads, errors = codec.loads, codec.errors
+    (lastkeytext, lastkey) = (None, None)
     for input in inputs:
         try:
-            yield map(eval, input.split('\t', 1))
-        except (ValueError, TypeError):
-            print >> sys.stderr, 'WARNING: skipping bad input (%s)' % input
+            output = input.split('\t', 1)
+            # sorted inputs tend to repeat the same key many times in a row
+            if output[0] == lastkeytext:
+                output[0] = lastkey
+            else:
+                key = loads(output[0])
+                if type(key) in _immutabletypes:
+                    (lastkeytext, lastkey) = (output[0], key)
+                output[0] = key
+            if len(output) > 1:
+                output[1] = loads(output[1])
+            yield output
+        except errors:
+            if badinputs < MAX_LOGGED_BADINPUTS:
+                print >> sys.stderr, 'WARNING: skipping bad input (%s)' % input
             if os.environ.has_key('dumbo_debug'):
                 raise
+            badinputs += 1
             incrcounter('Dumbo', 'Bad inputs', 1)
 
 
@@ -73,11 +472,131 @@ def dumptext(outputs):
         del newoutput[:]
 
 
-def loadtext(inputs):
-    offset = 0
+def loadtext(inputs, offset=0):
     for input in inputs:
         yield (offset, input)
-        offset += len(input)
+        offset += len(input) + 1  # plus the stripped newline
+
+
+def readsplit(file, offset, length):
+    """
+    Returns the byte offset of the first line that starts in the given
+    range of the file, together with an iterator over these lines. Like
+    for Hadoop's line reader, a line belongs to the range it starts in.
+    """
+    end = offset + length
+    file.seek(offset)
+    if offset:
+        offset += len(file.readline())  # belongs to the previous range
+    def lines(pos):
+        for line in file:
+            if pos > end:
+                break
+            yield line
+            pos += len(line)
+    return (offset, lines(offset))
+
+
+def loadtextfiles(splits, addpath=False):
+    """
+    Reads (offset, line) pairs from the given (path, offset, length) splits,
+    where a length of None means up to the end of the file. The keys become
+    (path, offset) pairs when addpath is True.
+    """
+    for (path, offset, length) in splits:
+        if type(path) is unicode:
+            path = path.encode('utf-8')
+        file = open(path, 'rb', TEXTINPUT_BUFSIZE)
+        if offset or length is not None:
+            if length is None:
+                length = os.fstat(file.fileno()).st_size - offset
+            (offset, lines) = readsplit(file, offset, length)
+        else:
+            lines = file
+        if addpath:
+            for line in lines:
+                yield ((path, offset), line[:-1])
+                offset += len(line)
+        else:
+            for line in lines:
+                yield (offset, line[:-1])
+                offset += len(line)
+        file.close()
+
+
+def expandpaths(paths):
+    """
+    Replaces glob patterns by the paths they match and directories by the
+    files they contain, skipping the ones that start with _ or .
+    """
+    files = []
+    for pattern in paths:
+        for path in (glob.glob(pattern) or [pattern]):
+            if os.path.isdir(path):
+                files.extend(os.path.join(path, name)
+                             for name in sorted(os.listdir(path))
+                             if not name[:1] in ('_', '.'))
+            else:
+                files.append(path)
+    return files
+
+
+def savefile(path, dirpath, filename):
+    """Copies a local file to a directory, which can also be on HDFS"""
+    if '://' in dirpath:  # typically the task's work output dir on HDFS
+        hadoop = 'hadoop'
+        if os.environ.get('HADOOP_HOME'):
+            hadoop = os.path.join(os.environ['HADOOP_HOME'], 'bin', 'hadoop')
+        retval = subprocess.call([hadoop, 'fs', '-put', path,
+                                  dirpath + '/' + filename])
+        if retval != 0:
+            print >> sys.stderr, 'WARNING: failed to save', filename
+        return
+    try:
+        os.makedirs(dirpath)
+    except OSError:
+        pass  # exists already, possibly created by a concurrent task
+    shutil.copy(path, os.path.join(dirpath, filename))
+
+
+def loadmanifest(dirpath, codec=None):
+    """
+    Returns the (part, first key, last key, number of records) tuples for
+    the parts of a local -totalorder output, in the order of the parts
+    """
+    paths = sorted(glob.glob(os.path.join(dirpath, '_manifest-*')))
+    lines = (line[:-1] for path in paths for line in open(path))
+    return [(part,) + tuple(manifest)
+            for (part, manifest) in loadcode(lines, codec)]
+
+
+def writesequencefile(file, keyclass, valueclass, records):
+    """
+    Writes an uncompressed Hadoop sequence file, given the Java classes of
+    the keys and values and the serialized (key, value) pairs
+    """
+    write = file.write
+    write('SEQ\x06')
+    for classname in (keyclass, valueclass):
+        write(chr(len(classname)) + classname)  # one byte vint for < 128
+    write('\x00\x00')  # neither record nor block compressed
+    write(struct.pack('>i', 0))  # no metadata
+    write(md5(keyclass + valueclass).digest())  # sync marker
+    for (key, value) in records:
+        write(struct.pack('>ii', len(key) + len(value), len(key)))
+        write(key)
+        write(value)
+
+
+def parsebytes(value):
+    """Parses sizes like '512', '64k', '256m' or '2g' into a number of bytes"""
+    value = str(value).strip()
+    factor = {'g': 1073741824, 'm': 1048576, 'k': 1024, 'b': 1}.get(
+        value[-1:].lower())
+    if factor:
+        return int(value[:-1]) * factor
+    return int(value)
+
 
 class Options(object):
     """
@@ -254,6 +773,27 @@ def execute(cmd,
     return system(cmd, stdout, stderr)
 
 
+def executeall(cmds,
+               procs,
+               printcmd=True,
+               stdout=sys.stdout,
+               stderr=sys.stderr):
+    """Executes the commands with at most procs of them running at once"""
+    (pending, running, retval) = (list(reversed(cmds)), {}, 0)
+    while running or (pending and retval == 0):
+        while pending and retval == 0 and len(running) < procs:
+            cmd = pending.pop()
+            if printcmd:
+                print >> stderr, 'EXEC:', cmd
+            proc = subprocess.Popen(cmd, shell=True, stdout=stdout,
+                                    stderr=stderr)
+            running[proc.pid] = proc
+        (pid, status) = os.wait()
+        if running.pop(pid, None) and status and not retval:
+            retval = os.WEXITSTATUS(status) or 1  # stop starting new ones
+    return retval
+
+
 def system(cmd, stdout=sys.stdout, stderr=sys.stderr):
     if sys.version[:3] == '2.4':
         return os.system(cmd)
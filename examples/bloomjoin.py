@@ -0,0 +1,55 @@
+"""
+Counts the number of logs per host, like join.py, but first builds a bloom
+filter over the -hostnames file, so that the logs for unknown hosts get
+dropped before the shuffle.
+"""
+
+import os
+import dumbo
+from dumbo.lib import JoinReducer, SecondaryMapper, BloomFilterMapper
+from dumbo.lib import bloomfilterreducer, sumreducer
+from dumbo.decor import primary
+
+def mapper(key, value):
+    yield value.split("\t", 1)
+
+class Reducer(JoinReducer):
+    def primary(self, key, values):
+        self.hostname = values.next()
+    def secondary(self, key, values):
+        for value in values:
+            yield self.hostname, 1
+
+def runner(job):
+    if job.getparam("buildfilter") == "yes":
+        job.additer(BloomFilterMapper(mapper, 1000), bloomfilterreducer)
+    else:
+        multimapper = dumbo.MultiMapper()
+        multimapper.add("hostnames", primary(mapper))
+        multimapper.add("logs", SecondaryMapper(mapper,
+                                                job.getparam("bloomfilter")))
+        job.additer(multimapper, Reducer)
+        job.additer(dumbo.identitymapper, sumreducer, combiner=sumreducer)
+
+def starter(program):
+    hostnames = program.delopt("hostnames")
+    if not hostnames:
+        return "No hostnames file specified"
+    filterpath = program.getopt("output") + "_bloomfilter"
+    builder = program.clone()
+    builder.delopts("input")
+    builder.delopts("output")
+    builder.addopt("input", hostnames)
+    builder.addopt("output", filterpath)
+    builder.addopt("outputformat", "text")
+    builder.addopt("overwrite", "yes")
+    builder.addparam("buildfilter", "yes")
+    if builder.start() != 0:
+        return "Building the bloom filter failed"
+    if not os.path.isfile(filterpath):
+        filterpath += "/part-00000"
+    program.addopt("input", hostnames)
+    program.addparam("bloomfilter", filterpath)
+
+if __name__ == "__main__":
+    dumbo.main(runner, starter)
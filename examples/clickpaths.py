@@ -0,0 +1,18 @@
+"""
+Outputs the pages each user visited in chronological order, by letting the
+shuffle sort the visits on their timestamps instead of the reducer.
+"""
+
+from dumbo.decor import opt
+
+def mapper(key, value):
+    (user, timestamp, page) = value.split("\t")
+    yield (user, int(timestamp)), page
+
+@opt("secondarysort", "yes")
+def reducer(key, values):
+    yield key, " > ".join(values)
+
+if __name__ == "__main__":
+    import dumbo
+    dumbo.run(mapper, reducer)
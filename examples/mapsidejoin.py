@@ -0,0 +1,53 @@
+"""
+Counts the number of logs per host, like join.py, but joins the logs with
+the hostnames on the map side when the -hostnames file is small enough.
+"""
+
+import dumbo
+from dumbo.lib import MapSideJoinMapper, JoinReducer, fitsmapsidejoin
+from dumbo.lib import sumreducer
+from dumbo.util import parsebytes
+from dumbo.decor import primary, secondary
+
+def mapper(key, value):
+    yield value.split("\t", 1)
+
+def joiner(key, hostname, value):
+    yield hostname or "unknown", 1
+
+class Reducer(JoinReducer):
+    def __init__(self):
+        self.hostname = "unknown"
+    def primary(self, key, values):
+        self.hostname = values.next()
+    def secondary(self, key, values):
+        hostname = self.hostname
+        self.hostname = "unknown"
+        for value in values:
+            yield hostname, 1
+
+def runner(job):
+    if job.getparam("mapsidejoin") == "yes":
+        hostnames = job.getparam("hostnames")
+        joinmapper = MapSideJoinMapper(mapper, hostnames, joiner=joiner,
+                                       outer=True)
+        job.additer(joinmapper, sumreducer, combiner=sumreducer)
+    else:
+        multimapper = dumbo.MultiMapper()
+        multimapper.add("hostnames", primary(mapper))
+        multimapper.add("logs", secondary(mapper))
+        job.additer(multimapper, Reducer)
+        job.additer(dumbo.identitymapper, sumreducer, combiner=sumreducer)
+
+def starter(program):
+    hostnames = program.delopt("hostnames")
+    if not hostnames:
+        return "No hostnames file specified"
+    maxbytes = parsebytes(program.delopt("maxbytes") or "1m")
+    if fitsmapsidejoin(program, hostnames, maxbytes):
+        program.addparam("hostnames", hostnames)
+    else:
+        program.addopt("input", hostnames)
+
+if __name__ == "__main__":
+    dumbo.main(runner, starter)
@@ -0,0 +1,31 @@
+"""
+Joins hostnames, racks and logs in a single pass, and counts the number of
+logs per host and rack.
+"""
+
+import dumbo
+from dumbo.lib import NWayJoinReducer, sumreducer
+from dumbo.decor import table
+
+def mapper(key, value):
+    yield value.split("\t", 1)
+
+class Reducer(NWayJoinReducer):
+    def __init__(self):
+        NWayJoinReducer.__init__(self, 3)
+    def join(self, key, tablevalues, values):
+        (hostnames, racks) = tablevalues
+        if hostnames and racks:
+            for value in values:
+                yield (hostnames[0], racks[0]), 1
+
+def runner(job):
+    multimapper = dumbo.MultiMapper()
+    multimapper.add("hostnames", table(1)(mapper))
+    multimapper.add("racks", table(2)(mapper))
+    multimapper.add("logs", table(3)(mapper))
+    job.additer(multimapper, Reducer)
+    job.additer(dumbo.identitymapper, sumreducer, combiner=sumreducer)
+
+if __name__ == "__main__":
+    dumbo.main(runner)
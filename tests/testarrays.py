@@ -0,0 +1,88 @@
+import os
+import unittest
+import numpy
+from dumbo import core, lib
+from dumbo.lib import arrays
+
+
+class ClassMapper(object):
+    """Class-style mapper that only works once configured"""
+
+    closed = []
+
+    def configure(self):
+        self.factor = 2
+
+    def map(self, key, value):
+        yield key, value * self.factor
+
+    def close(self):
+        self.closed.append(True)
+
+
+class TestArrays(unittest.TestCase):
+
+    def testaggregateblock(self):
+        keys = ['b', 'a', 'b', 'c', 'a']
+        values = [1, 2, 3, 4, 5]
+        output = dict(arrays.aggregateblock(keys, values, 'sum'))
+        self.assertEqual(output, {'a': 7, 'b': 4, 'c': 4})
+        output = dict(arrays.aggregateblock(keys, values, 'max'))
+        self.assertEqual(output, {'a': 5, 'b': 3, 'c': 4})
+        vectors = [(1, 2), (3, 4), (5, 6), (7, 8), (9, 10)]
+        output = dict(arrays.aggregateblock(keys, vectors, 'min'))
+        self.assertEqual(output['a'], (3, 4))
+        output = dict(arrays.aggregateblock(keys, values, 'stats'))
+        self.assertEqual(output['b'], (2, 4, 10, 1, 3))
+        self.assertEqual(list(arrays.aggregateblock([], [], 'sum')), [])
+
+    def testaggregatemapred(self):
+        def mapper(key, value):
+            yield key % 3, value
+        input = [(i, float(i)) for i in xrange(100)]
+        expected = dict(core.itermapred(input, mapper, lib.statscombiner))
+        expected = dict(core.itermapred(expected.iteritems(),
+                                        lib.identitymapper, lib.statsreducer))
+        aggmapper = arrays.AggregatingMapper(mapper, 'stats', blocksize=7)
+        output = core.itermapred(input, aggmapper,
+                                 arrays.aggregatecombiner('stats'))
+        output = dict(core.itermapred(output, lib.identitymapper,
+                                      arrays.aggregatereducer('stats')))
+        for key in expected:
+            self.assertEqual(output[key][0], expected[key][0])
+            for (x, y) in zip(output[key][1:], expected[key][1:]):
+                self.assertAlmostEqual(x, y)
+        self.assertRaises(ValueError, arrays.AggregatingMapper, mapper, 'avg')
+
+    def testvectorsum(self):
+        input = [('k', (i, 2 * i)) for i in xrange(10)]
+        aggmapper = arrays.AggregatingMapper(lib.identitymapper, blocksize=3)
+        output = core.itermapred(input, aggmapper, arrays.aggregatecombiner())
+        output = list(core.itermapred(output, lib.identitymapper,
+                                      arrays.aggregatereducer()))
+        self.assertEqual(output, [('k', (45, 90))])
+
+    def testarrayreducer(self):
+        def reducer(key, values):
+            self.assertTrue(isinstance(values, numpy.ndarray))
+            yield key, values.mean(axis=0).tolist()
+        input = [('k', (1, 2)), ('k', (3, 4))]
+        output = list(core.itermapred(input, lib.identitymapper,
+                                      lib.ArrayReducer(reducer)))
+        self.assertEqual(output, [('k', [2.0, 3.0])])
+
+    def testclassmapper(self):
+        aggmapper = arrays.AggregatingMapper(ClassMapper)
+        os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+        try:
+            aggmapper.configure()
+            output = list(core.itermap([('k', 1), ('k', 2)], aggmapper))
+            aggmapper.close()
+        finally:
+            del os.environ['dumbo_mrbase_class']
+        self.assertEqual(output, [('k', 6)])
+        self.assertEqual(ClassMapper.closed, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import base64
+import unittest
+from tempfile import mkstemp
+
+from dumbo import core
+from dumbo.util import getcodec
+from dumbo.lib.bloomfilter import BloomFilter, BloomFilterMapper, \
+    bloomfilterreducer
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def testmembership(self):
+        bloomfilter = BloomFilter(1000, 0.01)
+        for i in xrange(1000):
+            bloomfilter.add(str(i))
+        bloomfilter.add(('a', 1))
+        self.assertTrue(all(str(i) in bloomfilter for i in xrange(1000)))
+        self.assertTrue(('a', 1) in bloomfilter)
+        falsepositives = sum(str(i) in bloomfilter
+                             for i in xrange(1000, 11000))
+        self.assertTrue(falsepositives < 200)  # about 100 expected
+
+    def testupdate(self):
+        (bf1, bf2) = (BloomFilter(100), BloomFilter(100))
+        bf1.add('a')
+        bf2.add('b')
+        bf1.update(bf2)
+        self.assertTrue('a' in bf1 and 'b' in bf1)
+        self.assertRaises(ValueError, bf1.update, BloomFilter(1000))
+        copied = BloomFilter.fromstring(bf1.tostring())
+        self.assertEqual((copied.nbits, copied.nhashes, copied.bits),
+                         (bf1.nbits, bf1.nhashes, bf1.bits))
+
+    def testbuild(self):
+        def mapper(key, value):
+            yield value, key
+        input = [(i, 'k%i' % (i % 10)) for i in xrange(100)]
+        output = core.itermapred(input, BloomFilterMapper(mapper, 10),
+                                 bloomfilterreducer)
+        (key, value) = list(output)[0]
+        fd, path = mkstemp()
+        try:
+            os.write(fd, "'%s'\t'%s'\n" % (key, value))  # code
+            os.close(fd)
+            bloomfilter = BloomFilter.load(path)
+            self.assertTrue(all('k%i' % i in bloomfilter for i in xrange(10)))
+            open(path, 'w').write('%s\t%s\n' % (key, value))  # text
+            self.assertEqual(BloomFilter.load(path).bits, bloomfilter.bits)
+            codec = getcodec('marshal')
+            open(path, 'w').write('%s\t%s\n' % (codec.dumps(key),
+                                                codec.dumps(value)))
+            os.environ['dumbo_codec'] = 'marshal'
+            try:
+                self.assertEqual(BloomFilter.load(path).bits, bloomfilter.bits)
+            finally:
+                del os.environ['dumbo_codec']
+        finally:
+            os.remove(path)
+
+    def testclassmapper(self):
+        class ClassMapper(object):
+            closed = []
+            def configure(self):
+                self.prefix = 'k'
+            def map(self, key, value):
+                yield self.prefix + value, key
+            def close(self):
+                self.closed.append(True)
+        bfmapper = BloomFilterMapper(ClassMapper, 10)
+        os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+        try:
+            bfmapper.configure()
+            output = list(core.itermap([(1, 'a'), (2, 'b')], bfmapper))
+            bfmapper.close()
+        finally:
+            del os.environ['dumbo_mrbase_class']
+        bloomfilter = BloomFilter.fromstring(base64.b64decode(output[0][1]))
+        self.assertTrue('ka' in bloomfilter and 'kb' in bloomfilter)
+        self.assertEqual(ClassMapper.closed, [True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import unittest
+from struct import pack
+from tempfile import mkstemp
+
+from dumbo.lib import MapSideJoinMapper
+from dumbo.lib.cdbfile import CDBFile, cdbhash
+
+
+def writecdb(path, items):
+    """Writes a constant db the way cdbmake does"""
+    records, entries = [], [[] for _ in xrange(256)]
+    pos = 2048
+    for key, value in items:
+        records.append(pack('<LL', len(key), len(value)) + key + value)
+        h = cdbhash(key)
+        entries[h & 255].append((h, pos))
+        pos += len(records[-1])
+    header, tables = [], []
+    for bucket in entries:
+        slots = [(0, 0)] * (len(bucket) * 2)
+        for h, recordpos in bucket:
+            slot = (h >> 8) % len(slots)
+            while slots[slot][1]:
+                slot = (slot + 1) % len(slots)
+            slots[slot] = (h, recordpos)
+        header.append(pack('<LL', pos, len(slots)))
+        tables.append(''.join(pack('<LL', *s) for s in slots))
+        pos += len(slots) * 8
+    out = open(path, 'wb')
+    out.write(''.join(header) + ''.join(records) + ''.join(tables))
+    out.close()
+
+
+class TestCDBFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = mkstemp(suffix='.cdb')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testlookup(self):
+        items = [(str(i), 'v%i' % i) for i in xrange(1000)] + [('5', 'dup')]
+        writecdb(self.path, items)
+        db = CDBFile(self.path)
+        self.assertEqual(db['42'], 'v42')
+        self.assertEqual(list(db.getall('5')), ['v5', 'dup'])
+        self.assertEqual(db.get('missing'), None)
+        self.assertFalse('1000' in db)
+        self.assertRaises(KeyError, db.__getitem__, '-1')
+        self.assertEqual(list(db.iteritems()), items)
+        db.close()
+
+    def testempty(self):
+        writecdb(self.path, [])
+        db = CDBFile(self.path)
+        self.assertEqual(list(db.getall('a')), [])
+        self.assertEqual(list(db.iteritems()), [])
+        db.close()
+
+    def testmapsidejoin(self):
+        writecdb(self.path, [('a', '1'), ('b', '2'), ('b', '3')])
+        def mapper(key, value):
+            yield value, key
+        os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+        try:
+            joinmapper = MapSideJoinMapper(mapper, self.path)
+            self.assertEqual(joinmapper.opts['cachefile'],
+                             [self.path + '#' + os.path.basename(self.path)])
+            joinmapper.configure()
+            input = [(0, 'a'), (1, 'b'), (2, 'c')]
+            self.assertEqual(list(joinmapper(input)),
+                             [('a', ('1', 0)), ('b', ('2', 1)),
+                              ('b', ('3', 1))])
+            joinmapper.outer = True
+            self.assertEqual(list(joinmapper(input))[-1], ('c', (None, 2)))
+            joinmapper.close()
+
+            class ClassMapper(object):
+                closed = []
+                def configure(self):
+                    self.suffix = ''
+                def map(self, key, value):
+                    yield value + self.suffix, key
+                def close(self):
+                    self.closed.append(True)
+            joinmapper = MapSideJoinMapper(ClassMapper, self.path)
+            joinmapper.configure()
+            self.assertEqual(list(joinmapper(input[:1])), [('a', ('1', 0))])
+            joinmapper.close()
+            self.assertEqual(ClassMapper.closed, [True])
+        finally:
+            del os.environ['dumbo_mrbase_class']
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ from tempfile import mkstemp
 import cdb
 
 from dumbo.lib.cdbreducer import CDBReducer, CDBFactory
+from dumbo.lib.cdbfile import CDBFile
 
 
 class CDBTestCase(unittest.TestCase):
@@ -23,6 +24,7 @@ class CDBTestCase(unittest.TestCase):
         db = cdb.init(fn)
         self.assertEqual([(k, db[k]) for k in db.keys()],
                 [('k1', 'v1'), ('k2', 'v2')])
+        self.assertEqual(list(CDBFile(fn).getall('k2')), ['v2', 'v3'])
         os.remove(fn)
 
     def test_reducer(self):
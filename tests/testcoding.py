@@ -21,6 +21,54 @@ class TestCoding(unittest.TestCase):
 
     def teststring(self):
         self.dotest("{'key': 1}")
+        self.dotest("tab\tand\nnewline")
+        self.dotest(u"caf\xe9")
+
+    def testnumbers(self):
+        self.dotest(-12)
+        self.dotest(2 ** 70)
+        self.dotest(0.1)
+        self.dotest(None)
+
+    def testcodecs(self):
+        data = ('key\t', [1, 2.5, (None, True)], {'a': u'b'})
+        for name in ('literal', 'eval', 'marshal', 'pickle'):
+            dumped = "\t".join(util.dumpcode([("dummy", data)], name).next())
+            self.assertEqual(dumped.count("\t"), 1)
+            self.assertEqual(util.loadcode([dumped], name).next()[1], data)
+        dumped = "\t".join(util.dumpcode([("dummy", data)], 'json').next())
+        self.assertEqual(util.loadcode([dumped], 'json').next()[1],
+                         ['key\t', [1, 2.5, [None, True]], {'a': 'b'}])
+        self.assertRaises(ValueError, util.getcodec, 'nonexisting')
+
+    def testcanonicalcodecs(self):
+        parsed = 'total count'.split()[0]  # equal but not interned
+        self.assertFalse(parsed is 'total')
+        keys = ['total', parsed, ('total', 'total'), ('total', parsed)]
+        for name in ('literal', 'eval', 'json', 'marshal', 'pickle'):
+            dumped = list(util.dumpcode([(key, 1) for key in keys], name))
+            self.assertEqual(dumped[0], dumped[1])
+            self.assertEqual(dumped[2], dumped[3])
+            loaded = util.loadcode(('\t'.join(output) for output in dumped),
+                                   name)
+            self.assertEqual([key for (key, value) in loaded][:2], keys[:2])
+
+    def testliteral(self):
+        for text in ["'Brian'", "6", "('A', 'Brian')", "010", "1L", "1e5",
+                     "(1,)", "()", "[1, 2,]", "{1: 2,}", "set([1, 2])",
+                     "((1, 2), [3, (4,)], {'a': {'b': ()}})", "-0.5\n",
+                     "('a', 'b')", "('a', -12, 0)", "('a, b', 'c')",
+                     "('a', 'b, c')", "(\"'a', 'b'\", 1)", "('a',)",
+                     "('a\\n', 1)", "(01, -0)", "('a', 1L)"]:
+            self.assertEqual(util.loadliteral(text), eval(text))
+            self.assertEqual(type(util.loadliteral(text)), type(eval(text)))
+
+    def testbadliteral(self):
+        for text in ["__import__('os')", "open('x')", "'abc", "(1 2)",
+                     "[1,,2]", "{1:}", "(1]"]:
+            self.assertRaises((ValueError, SyntaxError),
+                              util.loadliteral, text)
+        self.assertEqual(list(util.loadcode(["'key'\tos.getcwd()"])), [])
 
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCoding)
@@ -1,5 +1,6 @@
 import os
 import sys
+import shutil
 import unittest
 from dumbo import cmd, util
 from dumbo.util import Options
@@ -23,7 +24,14 @@ class TestExamples(unittest.TestCase):
 
     def tearDown(self):
         self.logfile.close()
-        os.remove(self.outfile)
+        if os.path.isdir(self.outfile):
+            shutil.rmtree(self.outfile)
+        else:
+            os.remove(self.outfile)
+
+    def loadparts(self):
+        paths = util.expandpaths([self.outfile])
+        return util.loadcode(line for path in paths for line in open(path))
 
     def testwordcount(self):
         opts = self.common_opts
@@ -34,6 +42,204 @@ class TestExamples(unittest.TestCase):
         output = dict(util.loadcode(open(self.outfile)))
         self.assertEqual(6, int(output['Brian']))
 
+    def testwordcountencodepipe(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('directinput', 'no')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(6, int(output['Brian']))
+
+    def testwordcountcodec(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('codec', 'marshal')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile), 'marshal'))
+        self.assertEqual(6, int(output['Brian']))
+
+    def testwordcounthash(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('combining', 'hash'), ('combinerentries', '3')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(6, int(output['Brian']))
+
+    def testwordcountreducegrouping(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('reducegrouping', 'hash')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        expected = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(6, int(expected['Brian']))
+        os.remove(self.outfile)
+        opts += [('localprocs', '2')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        self.assertEqual(expected, dict(self.loadparts()))
+
+    def testwordcountmapprocs(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('mapprocs', '3')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(6, int(output['Brian']))
+
+    def testwordcountlocalprocs(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('localprocs', '3')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        self.assertTrue(os.path.isdir(self.outfile))
+        output = dict(self.loadparts())
+        self.assertEqual(6, int(output['Brian']))
+
+    def testwordcountmanyfiles(self):
+        inputdir = self.tstdir + 'manyfiles'
+        os.mkdir(inputdir)
+        try:
+            for i in xrange(2500):  # too many paths for a single argument
+                open('%s/%s-%04i.txt' % (inputdir, 'x' * 40, i),
+                     'w').write('Brian\n')
+            opts = self.common_opts
+            opts += [('input', inputdir), ('output', self.outfile)]
+            retval = cmd.start(self.exdir+'wordcount.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+            self.assertEqual(0, retval)
+            output = dict(util.loadcode(open(self.outfile)))
+            self.assertEqual(2500, int(output['Brian']))
+        finally:
+            shutil.rmtree(inputdir)
+
+    def testwordcountdelinputs(self):
+        inputdir = self.tstdir + 'delinputs'
+        os.mkdir(inputdir)
+        try:
+            for name in ('part-0', 'part-1', 'keep'):
+                shutil.copy(self.exdir+'brian.txt', inputdir+'/'+name)
+            opts = self.common_opts
+            opts += [('input', inputdir+'/part-*'), ('output', self.outfile),
+                     ('localprocs', '2'), ('delinputs', 'yes')]
+            retval = cmd.start(self.exdir+'wordcount.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+            self.assertEqual(0, retval)
+            output = dict(self.loadparts())
+            self.assertEqual(12, int(output['Brian']))
+            self.assertEqual(os.listdir(inputdir), ['keep'])
+        finally:
+            shutil.rmtree(inputdir)
+
+    def testwordcounttotalorder(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('localprocs', '2'), ('numreducetasks', '3'),
+                 ('totalorder', '1.0')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        self.assertFalse(os.path.exists(self.outfile + '_splits'))
+        paths = util.expandpaths([self.outfile])
+        self.assertEqual(3, len(paths))
+        keys = [line.split('\t', 1)[0] for path in paths
+                for line in open(path)]
+        self.assertEqual(sorted(keys), keys)
+        manifest = util.loadmanifest(self.outfile)
+        self.assertEqual(['part-00000', 'part-00001', 'part-00002'],
+                         [part for (part, _, _, _) in manifest])
+        self.assertEqual(len(keys), sum(n for (_, _, _, n) in manifest))
+        output = dict(self.loadparts())
+        self.assertEqual(6, int(output['Brian']))
+        self.assertEqual(manifest[0][1], min(output))
+
+    def testwordcountprofile(self):
+        from StringIO import StringIO
+        from dumbo import profiling
+        profiledir = self.tstdir + 'profiles'
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('profile', 'cpu'), ('profiledir', profiledir),
+                 ('mapprocs', '2')]
+        try:
+            retval = cmd.start(self.exdir+'wordcount.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+            self.assertEqual(0, retval)
+            profiles = profiling.findprofiles(profiledir)
+            self.assertEqual(['cpu'], profiles.keys())
+            self.assertEqual(4, len(profiles['cpu']))  # 1 + 2 mappers, reducer
+            out = StringIO()
+            self.assertEqual(0, profiling.report(profiledir, out=out))
+            self.assertTrue('merged from 4 tasks' in out.getvalue())
+            self.assertTrue('wordcount.py' in out.getvalue())
+        finally:
+            shutil.rmtree(profiledir, ignore_errors=True)
+
+    def testwordcountprofilealloc(self):
+        try:
+            import tracemalloc
+            return  # -profile alloc is supported
+        except ImportError:
+            pass
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('profile', 'alloc')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertNotEqual(0, retval)
+        self.assertTrue('needs the tracemalloc module' in
+                        open(self.tstdir+'log.txt').read())
+        open(self.outfile, 'w').close()  # for tearDown
+
+    def testwordcounttiming(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('timing', 'yes')]
+        retval = cmd.start(self.exdir+'wordcount.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(6, int(output['Brian']))
+        self.logfile.flush()
+        log = open(self.logfile.name).read()
+        self.assertTrue('Dumbo Timing,Task wall ms,' in log)
+        self.assertTrue('Dumbo Timing,Map output records,' in log)
+
+    def testwordcounttimingmapprocs(self):
+        inpath = self.tstdir + 'timinginput.txt'
+        inputfile = open(inpath, 'w')
+        for i in xrange(60000):
+            inputfile.write('word%i Brian\n' % (i % 100))
+        inputfile.close()
+        opts = self.common_opts
+        opts += [('input', inpath), ('output', self.outfile),
+                 ('timing', 'yes'), ('mapprocs', '2')]
+        try:
+            retval = cmd.start(self.exdir+'wordcount.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+        finally:
+            os.remove(inpath)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(60000, int(output['Brian']))
+        self.logfile.flush()
+        log = open(self.logfile.name).read()
+        self.assertFalse('Traceback' in log)
+        self.assertTrue('Dumbo Timing,Task wall ms,' in log)
+
     def testoowordcount(self):
         opts = self.common_opts
         opts += [('excludes', self.exdir+'excludes.txt'),
@@ -62,6 +268,16 @@ class TestExamples(unittest.TestCase):
         output = dict(util.loadcode(open(self.outfile)))
         self.assertEqual(14, int(output['e']))
 
+    def testitertwicelocalprocs(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'brian.txt'), ('output', self.outfile),
+                 ('localprocs', '2')]
+        retval = cmd.start(self.exdir+'itertwice.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(self.loadparts())
+        self.assertEqual(14, int(output['e']))
+
     def testjoin(self):
         opts = self.common_opts
         opts += [('input', self.exdir+'hostnames.txt'),
@@ -73,6 +289,91 @@ class TestExamples(unittest.TestCase):
         output = dict(util.loadcode(open(self.outfile)))
         self.assertEqual(5, int(output['node1']))
 
+    def testjoinlocalprocs(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'hostnames.txt'),
+                 ('input', self.exdir+'logs.txt'),
+                 ('output', self.outfile), ('localprocs', '2'),
+                 ('numreducetasks', '3')]
+        retval = cmd.start(self.exdir+'join.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(self.loadparts())
+        self.assertEqual(5, int(output['node1']))
+
+    def testjoinmapprocs(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'hostnames.txt'),
+                 ('input', self.exdir+'logs.txt'),
+                 ('output', self.outfile), ('mapprocs', '2')]
+        retval = cmd.start(self.exdir+'join.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual(5, int(output['node1']))
+
+    def testmapsidejoin(self):
+        for maxbytes in ('1m', '10'):  # map-side and reduce-side join
+            opts = Options(self.common_opts)
+            opts += [('input', self.exdir+'logs.txt'),
+                     ('hostnames', self.exdir+'hostnames.txt'),
+                     ('maxbytes', maxbytes), ('output', self.outfile)]
+            retval = cmd.start(self.exdir+'mapsidejoin.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+            self.assertEqual(0, retval)
+            output = dict(util.loadcode(open(self.outfile)))
+            self.assertEqual(5, int(output['node1']))
+            self.assertEqual(3, int(output['node5']))
+
+    def testbloomjoin(self):
+        hostnames = self.tstdir + 'somehostnames.txt'
+        lines = open(self.exdir+'hostnames.txt').readlines()[:3]
+        open(hostnames, 'w').writelines(lines)
+        opts = self.common_opts
+        opts += [('input', self.exdir+'logs.txt'), ('hostnames', hostnames),
+                 ('output', self.outfile)]
+        try:
+            retval = cmd.start(self.exdir+'bloomjoin.py', opts,
+                               stdout=self.logfile, stderr=self.logfile)
+        finally:
+            os.remove(hostnames)
+            shutil.rmtree(self.outfile + '_bloomfilter', ignore_errors=True)
+            if os.path.isfile(self.outfile + '_bloomfilter'):
+                os.remove(self.outfile + '_bloomfilter')
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual({'node1': 5, 'node2': 3}, output)
+
+    def teststarjoin(self):
+        opts = self.common_opts
+        opts += [('input', self.exdir+'hostnames.txt'),
+                 ('input', self.exdir+'racks.txt'),
+                 ('input', self.exdir+'logs.txt'),
+                 ('output', self.outfile)]
+        retval = cmd.start(self.exdir+'starjoin.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        output = dict(util.loadcode(open(self.outfile)))
+        self.assertEqual({('node1', 'rack1'): 5, ('node2', 'rack1'): 3,
+                          ('node3', 'rack2'): 3, ('node4', 'rack2'): 2},
+                         output)
+
+    def testclickpaths(self):
+        expected = {'alice': '/home > /products > /cart > /checkout',
+                    'bob': '/home > /about > /jobs'}
+        opts = self.common_opts
+        opts += [('input', self.exdir+'visits.txt'), ('output', self.outfile)]
+        retval = cmd.start(self.exdir+'clickpaths.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        self.assertEqual(expected, dict(util.loadcode(open(self.outfile))))
+        os.remove(self.outfile)
+        opts += [('localprocs', '2'), ('numreducetasks', '2')]
+        retval = cmd.start(self.exdir+'clickpaths.py', opts,
+                           stdout=self.logfile, stderr=self.logfile)
+        self.assertEqual(0, retval)
+        self.assertEqual(expected, dict(self.loadparts()))
+
     def testmulticount(self):
         opts = self.common_opts
         opts += [('input', self.exdir+'brian.txt'),
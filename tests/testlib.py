@@ -1,5 +1,9 @@
+import os
 import unittest
-from dumbo import lib, core
+import cPickle
+from tempfile import mkstemp
+from dumbo import lib, core, decor
+from dumbo.backends.common import JoinKey
 
 class TestLib(unittest.TestCase):
 
@@ -11,6 +15,200 @@ class TestLib(unittest.TestCase):
         self.assertEqual(output['testkey'][1], 4.5) # mean
         self.assertAlmostEqual(output['testkey'][2], 3.02765035409749) # std 
 
+    def testblockmapper(self):
+        def mapper(keys, values):
+            self.assertTrue(len(keys) <= 3)
+            for key, value in zip(keys, values):
+                yield value, key
+        input = [(i, str(i)) for i in xrange(10)]
+        output = list(core.itermap(input, lib.BlockMapper(mapper, 3)))
+        self.assertEqual(output, [(str(i), i) for i in xrange(10)])
+
+        @decor.blockmapper(4, blockoutput=True)
+        def blockmapper(keys, values):
+            yield values, [key * 2 for key in keys]
+        output = list(core.itermap(input, blockmapper))
+        self.assertEqual(output, [(str(i), i * 2) for i in xrange(10)])
+
+        class ClassMapper(object):
+            closed = []
+            def configure(self):
+                self.factor = 3
+            def map(self, keys, values):
+                for key, value in zip(keys, values):
+                    yield value, key * self.factor
+            def close(self):
+                self.closed.append(True)
+        blockmapper = lib.BlockMapper(ClassMapper, 3)
+        os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+        try:
+            blockmapper.configure()
+            output = list(core.itermap(input, blockmapper))
+            blockmapper.close()
+        finally:
+            del os.environ['dumbo_mrbase_class']
+        self.assertEqual(output, [(str(i), i * 3) for i in xrange(10)])
+        self.assertEqual(ClassMapper.closed, [True])
+
+    def testmultimapper(self):
+        def mapper(name):
+            def mapper_(key, value):
+                yield name, value
+            return mapper_
+        multimapper = lib.MultiMapper()
+        multimapper.add('logs', mapper('substring'))
+        multimapper.add('*/2010-??/*.gz', mapper('glob'), match='glob')
+        multimapper.add(r'part-\d+$', mapper('regex'), match='regex')
+        self.assertRaises(ValueError, multimapper.add, 'x', mapper('x'), 'y')
+        input = [(('/logs/2010-01/a.gz', 0), 1), (('/logs/2010-01/a.gz', 1), 2),
+                 (('/data/part-00001', 0), 3), (('/other', 0), 4)]
+        output = list(multimapper(input))
+        self.assertEqual(output, [('substring', 1), ('glob', 1),
+                                  ('substring', 2), ('glob', 2),
+                                  ('regex', 3)])
+        self.assertEqual(len(multimapper.dispatch), 3)
+
+    def testjoinkey(self):
+        keys = [JoinKey('b'), JoinKey('b', True), JoinKey('a'),
+                JoinKey('a', True)]
+        self.assertEqual([(jk.body, jk.isprimary) for jk in sorted(keys)],
+                         [('a', True), ('a', False), ('b', True), ('b', False)])
+        jk = JoinKey('a', True)
+        self.assertEqual(jk.dump(), ('a', 1))
+        self.assertEqual(JoinKey.fromdump(JoinKey('a').dump()), JoinKey('a'))
+        self.assertTrue(jk.withbody('c').isprimary)
+        self.assertEqual(jk.withbody('c').body, 'c')
+        self.assertEqual(jk.body, 'a')
+        copied = cPickle.loads(cPickle.dumps(jk, 2))
+        self.assertEqual((type(copied), copied), (JoinKey, jk))
+
+        def mapper(key, value):
+            yield key, value
+            yield key + '2', value
+        input = [(JoinKey('a'), 1)]
+        output = list(core.itermap(input, lib.JoinMapper(mapper, True)))
+        self.assertEqual([(k.dump(), v) for (k, v) in output],
+                         [(('a', 1), 1), (('a2', 1), 1)])
+
+    def testnwayjoin(self):
+        def mapper(key, value):
+            yield value
+        tables = [[('a', 1), ('b', 2)], [('a', 'x'), ('a', 'y')],
+                  [('a', 10), ('b', 20), ('c', 30)]]
+        mapped = []
+        for (tag, table) in enumerate(tables):
+            tablemapper = decor.table(tag + 1)(mapper)
+            input = [(JoinKey(None), value) for value in table]
+            mapped.extend(core.itermap(input, tablemapper))
+        self.assertEqual(sorted(k.tag for (k, v) in mapped),
+                         [1, 1, 2, 2, 3, 3, 3])
+        output = [(k.body, v) for (k, v) in
+                  core.iterreduce(sorted(mapped), lib.NWayJoinReducer(3))]
+        self.assertEqual(output, [('a', (1, 'x', 10)), ('a', (1, 'y', 10))])
+        os.environ['dumbo_spillbytes'] = '1'
+        try:
+            spilled = [(k.body, v) for (k, v) in
+                       core.iterreduce(sorted(mapped), lib.NWayJoinReducer(3))]
+        finally:
+            del os.environ['dumbo_spillbytes']
+        self.assertEqual(spilled, output)
+        self.assertRaises(ValueError, lib.TableMapper, mapper, 10)
+        self.assertRaises(ValueError, lib.TableMapper, mapper, 0)
+        self.assertRaises(ValueError, lib.NWayJoinReducer, 10)
+
+    def testspillablevalues(self):
+        values = lib.SpillableValues(xrange(10), maxbytes=1024)
+        self.assertFalse(values.spilled)
+        self.assertEqual((len(values), list(values)), (10, range(10)))
+        values = lib.SpillableValues(iter(xrange(1000)), maxbytes=1024)
+        self.assertTrue(values.spilled)
+        values.extend(xrange(1000, 1010))
+        self.assertEqual(len(values), 1010)
+        self.assertEqual(list(values), range(1010))
+        self.assertEqual(sum(values), sum(xrange(1010)))
+        self.assertEqual((values[0], values[-1]), (0, 1009))
+        self.assertRaises(IndexError, values.__getitem__, 1010)
+        values.close()
+        @decor.spillable
+        def reducer(key, values):
+            total = float(sum(values))
+            for value in values:
+                yield key, value / total
+        input = [('k', 1), ('k', 3)]
+        output = list(core.itermapred(input, lib.identitymapper, reducer))
+        self.assertEqual(output, [('k', 0.25), ('k', 0.75)])
+
+    def testhotkeys(self):
+        def mapper(key, value):
+            yield value, 1
+        input = [(i, 'hot') for i in xrange(1000)] + [(1000, 'cold')]
+        sampler = lib.HotKeySampler(mapper, rate=0.5)
+        output = list(core.itermapred(input, sampler,
+                                      lib.hotkeyreducer(100, rate=0.5)))
+        self.assertEqual([k for (k, v) in output], ['hot'])
+        fd, path = mkstemp()
+        os.write(fd, "'hot'\t1000\n42\t100\n")
+        os.close(fd)
+        try:
+            self.assertEqual(lib.loadhotkeys(path),
+                             frozenset(["'hot'", 'hot', '42', 42]))
+        finally:
+            os.remove(path)
+
+        class ClassMapper(object):
+            closed = []
+            def configure(self):
+                self.rate = 1
+            def map(self, key, value):
+                yield value, self.rate
+            def close(self):
+                self.closed.append(True)
+        sampler = lib.HotKeySampler(ClassMapper, rate=1.0)
+        os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+        try:
+            sampler.configure()
+            output = list(core.itermap(input[-2:], sampler))
+            sampler.close()
+        finally:
+            del os.environ['dumbo_mrbase_class']
+        self.assertEqual(output, [('hot', 1), ('cold', 1)])
+        self.assertEqual(ClassMapper.closed, [True])
+
+    def testsaltedjoin(self):
+        def mapper(key, value):
+            yield value.split('\t', 1)
+        class Reducer(lib.JoinReducer):
+            def primary(self, key, values):
+                self.name = values.next()
+                yield key, 'primary'
+            def secondary(self, key, values):
+                for value in values:
+                    yield self.name, value
+        hostnames = [(0, 'h1\tnode1'), (1, 'h2\tnode2')]
+        logs = [(i, 'h1\tlog%i' % i) for i in xrange(10)] + [(10, 'h2\tlog')]
+        primary = lib.PrimaryMapper(mapper, hotkeys=['h1'], salts=4)
+        secondary = lib.SecondaryMapper(mapper, hotkeys=['h1'], salts=4)
+        for joinmapper in (primary, secondary):
+            joinmapper.hot = frozenset(joinmapper.hotkeys)  # as configured
+        keys = lambda data: [(JoinKey(k), v) for (k, v) in data]
+        mapped = list(core.itermap(keys(hostnames), primary)) + \
+                 list(core.itermap(keys(logs), secondary))
+        self.assertEqual(sorted(set(k.salt for (k, v) in mapped)),
+                         [None, 0, 1, 2, 3])
+        self.assertEqual(sorted(k.dump() for (k, v) in mapped
+                                if k.isprimary and k.body == 'h1'),
+                         [('h1', salt, 1) for salt in xrange(4)])
+        output = [(k.body, v) for (k, v) in
+                  core.iterreduce(sorted(mapped), Reducer())]
+        self.assertEqual(sorted(output),
+                         [('h1', 'primary'), ('h2', 'primary'),
+                          ('node1', 'log0'), ('node1', 'log1'),
+                          ('node1', 'log2'), ('node1', 'log3'),
+                          ('node1', 'log4'), ('node1', 'log5'),
+                          ('node1', 'log6'), ('node1', 'log7'),
+                          ('node1', 'log8'), ('node1', 'log9'),
+                          ('node2', 'log')])
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestMapReduce)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,5 +1,6 @@
+import time
 import unittest
-from dumbo import core
+from dumbo import core, lib
 
 class TestMapRed(unittest.TestCase):
     def testwordcount(self):
@@ -12,6 +13,96 @@ class TestMapRed(unittest.TestCase):
         self.assertEqual(output['one'],2)
         self.assertEqual(output['two'],3)
 
+    def testpicksplits(self):
+        counts = [(key, 1) for key in 'abcdefgh']
+        self.assertEqual(core.picksplits(counts, 4), ['c', 'e', 'g'])
+        counts = [('a', 100), ('b', 1), ('c', 1), ('d', 1)]
+        self.assertEqual(core.picksplits(counts, 3), ['b', 'c'])
+        self.assertEqual(core.picksplits([('a', 5)], 3), [])
+        reducer = core.splitsreducer(2)
+        output = list(core.itermapred(zip('aabbbc', range(6)),
+                                      lib.identitymapper, reducer))
+        self.assertEqual(output, [('b', None)])
+
+    def testhashcombine(self):
+        def reducer(key, values):
+            yield key, sum(values)
+        input = [(word, 1) for word in 'abcabcaaaaaaaaaaaaaaaaaaaaaaaaab']
+        expected = dict(core.itermapred(input, lib.identitymapper, reducer))
+        for evict in ('lru', 'largest'):
+            for associative in (True, False):
+                output = core.iterhashcombine(iter(input), reducer,
+                                              maxentries=2, evict=evict,
+                                              associative=associative)
+                totals = {}
+                for key, value in output:
+                    totals[key] = totals.get(key, 0) + value
+                self.assertEqual(totals, expected)
+        output = list(core.iterhashcombine(iter(input), lib.sumreducer,
+                                           associative=True))
+        self.assertEqual(sorted(output), sorted(expected.items()))
+
+    def testhashcombineunhashable(self):
+        input = [(['a'], 1), ('b', 1), (['a'], 1)]
+        output = list(core.iterhashcombine(iter(input), lib.sumreducer))
+        self.assertEqual(len(output), 3)
+        self.assertEqual(output.count((['a'], 1)), 2)
+
+    def testsecondarysort(self):
+        numbers = [-1e9, -2.5, -1, 0, 0.5, 1, 9, 10, 2 ** 40]
+        encoded = [core.sortablefield(n) for n in numbers]
+        self.assertEqual(sorted(encoded), encoded)
+        self.assertEqual(len(set(map(len, encoded))), 1)
+        self.assertEqual(core.sortablefield((1, 10)),
+                         (core.sortablefield(1), core.sortablefield(10)))
+        self.assertRaises(TypeError, core.sortablefield, 'b')
+        self.assertRaises(TypeError, core.sortablefield, (1, 'b'))
+        input = [(('a', 10), 'z'), (('b', 2), 'y'), (('a', 9), 'x'),
+                 (('a', -3), 'w')]
+        shuffled = sorted((core.secondarysortkey(k), v) for (k, v) in input)
+        output = list(core.iterreduce(shuffled, lambda k, vs: [(k, list(vs))],
+                                      groupkey=lambda k: k[1]))
+        self.assertEqual(sorted(output), [('a', ['w', 'x', 'z']), ('b', ['y'])])
+
+    def testhashreduce(self):
+        input = [(i % 50, 1) for i in xrange(5000)] + [(['a'], 1), (['a'], 2)]
+        expected = dict(core.itermapred(input[:-2], lib.identitymapper,
+                                        lib.sumreducer))
+        for maxbytes in (None, 1000, 10):
+            output = list(core.iterhashreduce(iter(input), lib.sumreducer,
+                                              maxbytes=maxbytes))
+            self.assertEqual(output[-1], (['a'], 3))
+            self.assertEqual(dict(output[:-1]), expected)
+            self.assertEqual(len(output), 51)
+
+    def testforkmap(self):
+        def mapper(data):
+            for key, value in data:
+                yield value, key
+        input = [(i, i % 7) for i in xrange(2000)]
+        output = list(core.iterforkmap(iter(input), mapper, 3))
+        self.assertEqual(sorted(output), sorted((v, k) for k, v in input))
+        def failing(data):
+            raise ValueError('boom')
+        self.assertRaises(core.Error, list,
+                          core.iterforkmap(iter(input), failing, 2))
+
+    def testforkmaptiming(self):
+        from dumbo import profiling
+        def mapper(data):
+            for key, value in data:
+                if key % 100 == 0:
+                    time.sleep(0.001)
+                yield key, len(value)
+        input = [(i, 'x' * 10) for i in xrange(60000)]
+        timer = profiling.PhaseTimer(interval=0.001)
+        timer.start()
+        try:
+            output = list(core.iterforkmap(iter(input), mapper, 2))
+        finally:
+            timer.stop()
+        self.assertEqual(sorted(output), [(i, 10) for i in xrange(60000)])
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestMapReduce)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,90 @@
+import unittest
+from dumbo import util
+from dumbo.memory import MemoryManager, privaterss
+
+
+class FakeManager(object):
+    """Reports pressure on every third check"""
+
+    def __init__(self):
+        (self.checks, self.spills) = (0, 0)
+
+    def overlimit(self):
+        self.checks += 1
+        return self.checks % 3 == 0
+
+    pressure = overlimit
+
+    def released(self):
+        self.spills += 1
+
+
+class TestMemory(unittest.TestCase):
+
+    def testmanager(self):
+        rss = privaterss()
+        if rss is None:
+            return  # no /proc
+        self.assertTrue(rss > 0)
+        memory = MemoryManager(1, checkinterval=2)
+        self.assertTrue(memory.overlimit())
+        self.assertFalse(memory.pressure())
+        self.assertTrue(memory.pressure())
+        memory.released()  # memory does not drop, so no pressure until it grows
+        self.assertFalse(memory.overlimit())
+        hog = ' ' * (4 * memory.margin + 4194304)
+        self.assertTrue(memory.overlimit())
+        del hog
+        self.assertRaises(MemoryError, MemoryManager(1, 1).sample)
+
+    def testwatch(self):
+        if privaterss() is None:
+            return  # no /proc
+        memory = MemoryManager(1, checkinterval=10)
+        self.assertEqual(list(memory.watch(xrange(100))), range(100))
+        memory = MemoryManager(1, 1, checkinterval=10)
+        records = memory.watch(xrange(100))
+        self.assertRaises(MemoryError, list, records)
+
+    def testsorted(self):
+        import random
+        values = [random.randint(0, 1000) for i in xrange(20000)]
+        memory = FakeManager()
+        self.assertEqual(list(util.sorted(values, memory=memory)),
+                         sorted(values))
+        self.assertTrue(memory.spills > 0)
+
+    def testhashcombine(self):
+        from dumbo import core, lib
+        data = [(i % 500, 1) for i in xrange(20000)]
+        memory = FakeManager()
+        totals = {}
+        for (key, value) in core.iterhashcombine(iter(data), lib.sumreducer,
+                                                 memory=memory):
+            totals[key] = totals.get(key, 0) + value
+        self.assertEqual(totals, dict((i, 40) for i in xrange(500)))
+        self.assertTrue(memory.spills > 0)
+
+    def testhashcombinehotkey(self):
+        from dumbo import core
+        calls = []
+        def combiner(key, values):
+            values = list(values)
+            calls.append(len(values))
+            yield key, sum(values)
+        data = [('hot', 1)] * 20000
+        output = list(core.iterhashcombine(iter(data), combiner,
+                                           maxbytes=10000))
+        self.assertEqual(sum(value for (key, value) in output), 20000)
+        self.assertTrue(max(calls) < 1000)
+        del calls[:]
+        memory = FakeManager()
+        output = list(core.iterhashcombine(iter(data), combiner,
+                                           memory=memory))
+        self.assertEqual(sum(value for (key, value) in output), 20000)
+        self.assertTrue(max(calls) < 20000)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMemory)
+    unittest.TextTestRunner(verbosity=2).run(suite)
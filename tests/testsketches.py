@@ -0,0 +1,143 @@
+import os
+import unittest
+import random
+from dumbo import core
+from dumbo.lib import sketches
+
+
+class ClassMapper(object):
+    """Class-style mapper that only works once configured"""
+
+    closed = []
+
+    def configure(self):
+        self.suffix = '!'
+
+    def map(self, key, value):
+        yield key, value + self.suffix
+
+    def close(self):
+        self.closed.append(True)
+
+
+def runconfigured(wrapper, input):
+    """Runs a mapper wrapper the way a map task does"""
+    os.environ['dumbo_mrbase_class'] = 'dumbo.backends.common.MapRedBase'
+    try:
+        wrapper.configure()
+        output = list(core.itermap(input, wrapper))
+        wrapper.close()
+    finally:
+        del os.environ['dumbo_mrbase_class']
+    return output
+
+
+class TestSketches(unittest.TestCase):
+
+    def testhyperloglog(self):
+        hll = sketches.HyperLogLog()
+        for i in xrange(50000):
+            hll.add('user%i' % i)
+            hll.add('user%i' % i)
+        self.assertTrue(abs(hll.count() - 50000) < 50000 * 0.05)
+        small = sketches.HyperLogLog()
+        for i in xrange(100):
+            small.add(i)
+        self.assertTrue(abs(small.count() - 100) < 5)
+        data = small.tostring()
+        self.assertTrue(len(data) < 1024)
+        small.update(sketches.HyperLogLog.fromstring(hll.tostring()))
+        self.assertTrue(abs(small.count() - 50100) < 50100 * 0.05)
+        self.assertRaises(ValueError, small.update, sketches.HyperLogLog(10))
+
+    def testhllmapred(self):
+        def mapper(key, value):
+            yield value % 3, key
+        input = [(i % 1000, i) for i in xrange(6000)]
+        hllmapper = sketches.HLLMapper(mapper, maxkeys=2)
+        mapped = core.itermapred(input, hllmapper, sketches.hllcombiner)
+        output = dict(core.itermapred(mapped, lambda k, v: [(k, v)],
+                                      sketches.hllreducer))
+        self.assertEqual(sorted(output), [0, 1, 2])
+        for count in output.itervalues():
+            self.assertTrue(abs(count - 1000) < 50)
+    def testkllsketch(self):
+        values = range(100000)
+        random.shuffle(values)
+        (first, second) = (sketches.KLLSketch(), sketches.KLLSketch())
+        for value in values[:60000]:
+            first.add(value)
+        for value in values[60000:]:
+            second.add(value)
+        self.assertTrue(len(first.tostring()) < 16 * 1024)
+        first.update(sketches.KLLSketch.fromstring(second.tostring()))
+        self.assertEqual(first.count(), 100000)
+        for (fraction, value) in zip((0.5, 0.99), first.quantiles((0.5, 0.99))):
+            self.assertTrue(abs(value - fraction * 100000) < 3000)
+        self.assertEqual(sketches.KLLSketch().quantile(0.5), None)
+
+    def testquantilemapred(self):
+        input = [(i % 2, float(i)) for i in xrange(20000)]
+        mapped = core.itermapred(input, lambda k, v: [(k, v)],
+                                 sketches.quantilecombiner(k=100))
+        output = dict(core.itermapred(mapped, lambda k, v: [(k, v)],
+                                      sketches.quantilereducer((0.1, 0.5))))
+        (n, p10, p50) = output[1]
+        self.assertEqual(n, 10000)
+        self.assertTrue(abs(p10 - 2000) < 600)
+        self.assertTrue(abs(p50 - 10000) < 600)
+        unsketched = core.itermapred(input[:10], lambda k, v: [(k, v)],
+                                     sketches.quantilereducer((0.5, )))
+        self.assertEqual(dict(unsketched)[0], (5, 4.0))
+    def testspacesaving(self):
+        items = [i for i in xrange(1, 21) for _ in xrange(1000 // i)]
+        items += range(100, 2100)
+        random.shuffle(items)
+        (first, second) = (sketches.SpaceSaving(50), sketches.SpaceSaving(50))
+        for item in items[:len(items) // 2]:
+            first.add(item)
+        for item in items[len(items) // 2:]:
+            second.add(item)
+        first.update(sketches.SpaceSaving.fromdump(second.dump()))
+        self.assertEqual(len(first.counters), 50)
+        top = first.topk(3)
+        self.assertEqual([item for (item, _, _) in top], [1, 2, 3])
+        for (item, count, error) in first.topk(50):
+            self.assertTrue(count - error <= items.count(item) <= count)
+
+    def testtopkmapred(self):
+        def mapper(key, value):
+            yield key, value
+        input = [('a', 'x')] * 50 + [('a', 'y')] * 30 + [('b', 'z')] * 5
+        input += [('a', i) for i in xrange(20)]
+        mapped = core.itermapred(input, sketches.TopKMapper(mapper, 10),
+                                 sketches.topkcombiner)
+        output = dict(core.itermapred(mapped, lambda k, v: [(k, v)],
+                                      sketches.topkreducer(2)))
+        self.assertEqual([item for (item, _, _) in output['a']], ['x', 'y'])
+        self.assertEqual(output['b'], [('z', 5, 0)])
+        keymapper = sketches.TopKMapper(mapper, 10, keys=True)
+        mapped = core.itermapred(input, keymapper, sketches.topkcombiner)
+        output = list(core.itermapred(mapped, lambda k, v: [(k, v)],
+                                      sketches.skewedkeyreducer(50)))
+        self.assertEqual(output, [('a', 100)])
+
+    def testhllclassmapper(self):
+        del ClassMapper.closed[:]
+        output = runconfigured(sketches.HLLMapper(ClassMapper),
+                               [('a', 'x'), ('a', 'y'), ('a', 'x')])
+        self.assertEqual([k for (k, v) in output], ['a'])
+        sketch = sketches.HyperLogLog.fromstring(output[0][1])
+        self.assertEqual(int(round(sketch.count())), 2)
+        self.assertEqual(ClassMapper.closed, [True])
+
+    def testtopkclassmapper(self):
+        del ClassMapper.closed[:]
+        output = runconfigured(sketches.TopKMapper(ClassMapper, 10),
+                               [('a', 'x'), ('a', 'y'), ('a', 'x')])
+        sketch = sketches.SpaceSaving.fromdump(output[0][1])
+        self.assertEqual(sketch.topk(1), [('x!', 2, 0)])
+        self.assertEqual(ClassMapper.closed, [True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -141,6 +141,98 @@ class TestUtil(unittest.TestCase):
 
 
 
+    def test_sorted(self):
+        import random
+        from dumbo import util
+        values = [(random.randint(0, 50), i) for i in xrange(1000)]
+        self.assertEqual(list(util.sorted(values)), sorted(values))
+        self.assertEqual(list(util.sorted(values, 64)), sorted(values))
+        self.assertEqual(list(util.sorted(values, 1000)), sorted(values))
+        key = lambda x: x[0]
+        self.assertEqual(list(util.sorted(values, 10, key=key)),
+                         sorted(values, key=key))
+        self.assertEqual(list(util.sorted(values, 7, key=key, reverse=True)),
+                         sorted(values, key=key, reverse=True))
+        self.assertEqual(list(util.sorted(values, 3, reverse=True)),
+                         sorted(values, reverse=True))
+
+    def test_spillfile(self):
+        from dumbo.util import SpillFile
+        spill = SpillFile(xrange(3000))
+        spill.extend(['a', ('b', 1)])
+        self.assertEqual(len(spill), 3002)
+        self.assertEqual(list(spill), range(3000) + ['a', ('b', 1)])
+        pairs = zip(spill, spill)  # concurrent iterators
+        self.assertEqual(pairs[-1], (('b', 1), ('b', 1)))
+        spill.close()
+
+    def test_counters(self):
+        import sys
+        from StringIO import StringIO
+        from dumbo import util
+        util.flushcounters()
+        util._reporting['statustime'] = 0.0
+        (stderr, sys.stderr) = (sys.stderr, StringIO())
+        try:
+            for i in xrange(100):
+                util.incrcounter('Group', 'Counter', 2)
+            util.setstatus('first')
+            util.setstatus('second')
+            buffered = sys.stderr.getvalue()
+            util.flushcounters()
+            lines = sys.stderr.getvalue()[len(buffered):].splitlines()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(buffered, 'reporter:status:first\n')
+        self.assertEqual(lines, ['reporter:counter:Group,Counter,200',
+                                 'reporter:status:second'])
+
+    def test_readsplit(self):
+        import tempfile
+        from dumbo.util import readsplit, loadtext
+        lines = ['%i %s\n' % (i, 'x' * (i % 13)) for i in xrange(500)]
+        data = tempfile.TemporaryFile()
+        data.write(''.join(lines))
+        size = data.tell()
+        expected = list(loadtext(line[:-1] for line in lines))
+        for splitsize in (1, 7, 100, size - 1, size):
+            outputs = []
+            for offset in xrange(0, size, splitsize):
+                (start, split) = readsplit(data, offset, splitsize)
+                outputs.extend(loadtext((line[:-1] for line in split), start))
+            self.assertEqual(outputs, expected)
+
+    def test_loadtextfiles(self):
+        import tempfile
+        from dumbo.util import loadtextfiles, loadtext
+        lines = ['%i %s\n' % (i, 'y' * (i % 5)) for i in xrange(300)]
+        data = tempfile.NamedTemporaryFile()
+        data.write(''.join(lines))
+        data.flush()
+        expected = list(loadtext(line[:-1] for line in lines))
+        output = list(loadtextfiles([(data.name, 0, None)]))
+        self.assertEqual(output, expected)
+        output = list(loadtextfiles([(data.name, 0, 100),
+                                     (data.name, 100, None)], addpath=True))
+        self.assertEqual(output, [((data.name, k), v) for (k, v) in expected])
+
+    def test_writesequencefile(self):
+        import struct
+        from cStringIO import StringIO
+        from dumbo.util import writesequencefile
+        output = StringIO()
+        writesequencefile(output, 'KeyClass', 'org.NullWritable',
+                          [('\x00\x00\x00\x01a', ''), ('bc', 'def')])
+        data = output.getvalue()
+        header = 'SEQ\x06\x08KeyClass\x10org.NullWritable\x00\x00' + \
+                 '\x00' * 4
+        self.assertTrue(data.startswith(header))
+        records = data[len(header) + 16:]
+        self.assertEqual(records, struct.pack('>ii', 5, 5) +
+                         '\x00\x00\x00\x01a' + struct.pack('>ii', 5, 2) +
+                         'bcdef')
+
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestUtil)
     unittest.TextTestRunner(verbosity=2).run(suite)